@@ -46,7 +46,8 @@ def reward(t):
 
 
 with nengo.Network(seed=2) as model:
-    env = td_grid.GridNode(environment, dt=0.001)
+    # no display when running headless (set NENGO_HEADLESS=1)
+    env = td_grid.make_grid_node(environment, dt=0.001)
 
     # define nodes for plotting data, managing agent's interface with environment
     reward_node = nengo.Node(reward, size_out=1, label='reward')
@@ -18,6 +18,9 @@ world.add(body, x=1, y=2, dir=2)
 
 tau=0.1
 
+# radar directions, relative to the way the body faces
+angles = np.linspace(-0.5, 0.5, 3)
+
 
 def move(t, x):
     '''Defines a continuous action policy for the agent'''
@@ -38,8 +41,7 @@ def move(t, x):
 
 def sensor(t):
     '''Obtain environment state using sensors'''
-    angles = (np.linspace(-0.5, 0.5, 3) + body.dir) % world.directions
-    return [body.detect(d, max_distance=4)[0] for d in angles]
+    return world.radar(body.x, body.y, body.dir, angles, max_distance=4)[0]
 
 
 def braiten(x):
@@ -55,7 +57,8 @@ def position_func(t):
 
 
 with nengo.Network(seed=2) as model:
-    env = grid.GridNode(world, dt=0.005)
+    # no display when running headless (set NENGO_HEADLESS=1)
+    env = grid.make_grid_node(world, dt=0.005)
 
     # define nodes and ensembles for managing action policy
     movement = nengo.Node(move, size_in=2)
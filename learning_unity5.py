@@ -48,12 +48,14 @@ with model:
     movement_node = nengo.Node(move, size_in=2, label='reward')
     nengo.Connection(movement, movement_node)
 
-    env = grid.GridNode(world, dt=0.005)
+    # no display when running headless (set NENGO_HEADLESS=1)
+    env = grid.make_grid_node(world, dt=0.005)
 
 
+    angles = np.linspace(-0.5, 0.5, 3)
+
     def detect(t):
-        angles = (np.linspace(-0.5, 0.5, 3) + body.dir) % world.directions
-        return [body.detect(d, max_distance=4)[0] for d in angles]
+        return world.radar(body.x, body.y, body.dir, angles, max_distance=4)[0]
 
 
     stim_radar = nengo.Node(detect)
@@ -1,3 +1,5 @@
 from . import maze
 from . import pacman_world
 from . import body
+from . import raster
+from . import display
@@ -1,44 +1,98 @@
+import collections
+import hashlib
+import heapq
+import inspect
+import math
+import os
+import pickle
 import random
 import sys
+import tempfile
+import types
+import weakref
 
-neighbour_synonyms = ('neighbours', 'neighbors', 'neighbour', 'neighbor')
+import numpy as np
+
+# (dx, dy) for each direction, indexed by [y % 2][dir]; only the hexagonal
+# layout differs between even and odd rows
+direction_offsets = {
+    4: (((0, -1), (1, 0), (0, 1), (-1, 0)),) * 2,
+    8: (((0, -1), (1, -1), (1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0),
+         (-1, -1)),) * 2,
+    6: (((1, 0), (0, 1), (-1, 1), (-1, 0), (-1, -1), (0, -1)),
+        ((1, 0), (1, 1), (0, 1), (-1, 0), (0, -1), (1, -1))),
+}
+
+
+class Neighbours:
+    '''The neighbouring Cells of a Cell, found on first use and then kept.'''
+
+    def __get__(self, cell, owner=None):
+        if cell is None:
+            return self
+        try:
+            return cell._neighbours
+        except AttributeError:
+            world = cell.world
+            row = world.neighbour_table[cell.y * world.width + cell.x]
+            cell._neighbours = tuple([world.get_cell_at(i)
+                                      for i in row.tolist()])
+            return cell._neighbours
 
 
 class Cell:
+    __slots__ = ('x', 'y', 'world', '_neighbours', '__weakref__')
     wall = False
 
-    def __getattr__(self, key):
-        if key in neighbour_synonyms:
-            pts = [self.world.get_point_in_direction(
-                self.x, self.y, dir) for dir in range(self.world.directions)]
-            ns = tuple([self.world.grid[y][x] for (x, y) in pts])
-            for n in neighbour_synonyms:
-                self.__dict__[n] = ns
-            return ns
-        raise AttributeError(key)
+    neighbours = neighbors = neighbour = neighbor = Neighbours()
+
+    @property
+    def agents(self):
+        world = self.world
+        return world.occupancy.at(self.y * world.width + self.x)
+
+
+class AgentCell:
+    '''The Cell an Agent is in; setting it keeps the World occupancy current.'''
+
+    def __get__(self, agent, owner=None):
+        if agent is None:
+            return None
+        try:
+            return agent._cell
+        except AttributeError:
+            return None
+
+    def __set__(self, agent, cell):
+        old = self.__get__(agent)
+        if old is not None and (cell is None or cell.world is not old.world):
+            old.world.occupancy.remove(agent)
+        if cell is not None:
+            cell.world.occupancy.add(agent, cell)
+        agent._cell = cell
 
 
 class Agent:
+    # the pose and cell are slots, but Agents keep a __dict__: subclasses
+    # and scripts give them attributes of their own (a Player's typeBody,
+    # state, size, color, speed and score, td_grid's reward, the pacman's
+    # obstacle_distances), and World.add sets `world` on each instance over
+    # the class default
+    __slots__ = ('x', 'y', 'dir', '_cell', '__dict__', '__weakref__')
     world = None
-    cell = None
-
-    def __setattr__(self, key, val):
-        if key == 'cell':
-            old = self.__dict__.get(key, None)
-            if old is not None:
-                old.agents.remove(self)
-            if val is not None:
-                val.agents.append(self)
-        self.__dict__[key] = val
-
-    def __getattr__(self, key):
-        if key == 'left_cell':
-            return self.get_cell_on_left()
-        elif key == 'right_cell':
-            return self.get_cell_on_right()
-        elif key == 'ahead_cell':
-            return self.get_cell_ahead()
-        raise AttributeError(key)
+    cell = AgentCell()
+
+    @property
+    def left_cell(self):
+        return self.get_cell_on_left()
+
+    @property
+    def right_cell(self):
+        return self.get_cell_on_right()
+
+    @property
+    def ahead_cell(self):
+        return self.get_cell_ahead()
 
     def turn(self, amount):
         self.dir = (self.dir + amount) % self.world.directions
@@ -53,10 +107,12 @@ class Agent:
         self.turn(self.world.directions / 2)
 
     def go_in_direction(self, dir):
-        target = self.cell.neighbour[dir]
-        if getattr(target, 'wall', False):
+        world = self.world
+        cell = self.cell
+        i = world.neighbour_table.item(cell.y * world.width + cell.x, int(dir))
+        if world.fields['wall'].item(i):
             return False
-        self.cell = target
+        self.cell = world.get_cell_at(i)
         return True
 
     def go_forward(self):
@@ -70,14 +126,21 @@ class Agent:
         self.turn_around()
         return r
 
+    def get_cell_in_direction(self, dir):
+        world = self.world
+        cell = self.cell
+        i = world.neighbour_table.item(cell.y * world.width + cell.x,
+                                       int(dir) % world.directions)
+        return world.get_cell_at(i)
+
     def get_cell_ahead(self):
-        return self.cell.neighbour[self.dir]
+        return self.get_cell_in_direction(self.dir)
 
     def get_cell_on_left(self):
-        return self.cell.neighbour[(self.dir - 1) % self.world.directions]
+        return self.get_cell_in_direction(self.dir - 1)
 
     def get_cell_on_right(self):
-        return self.cell.neighbour[(self.dir + 1) % self.world.directions]
+        return self.get_cell_in_direction(self.dir + 1)
 
     def go_towards(self, target, y=None):
         if not isinstance(target, Cell):
@@ -86,47 +149,798 @@ class Agent:
             raise CellularException('Agent has not been put in a World')
         if self.cell == target:
             return
-        best = None
-        for i, n in enumerate(self.cell.neighbours):
-            if n == target:
-                best = target
-                bestDir = i
-                break
-            if getattr(n, 'wall', False):
-                continue
-            dist = (n.x - target.x) ** 2 + (n.y - target.y) ** 2
-            if best is None or bestDist > dist:
-                best = n
-                bestDist = dist
-                bestDir = i
-        if best is not None:
-            if getattr(best, 'wall', False):
-                return False
-            self.cell = best
-            self.dir = bestDir
-            return True
+        step = self.world.get_step_towards(self.cell, target)
+        if step is None:
+            return False
+        dir, cell = step
+        if cell.wall:
+            return False
+        self.cell = cell
+        self.dir = dir
+        return True
 
     def update(self):
         pass
 
 
+class Field:
+    '''Descriptor that stores one Cell attribute in a World array.
+
+    Reads come from ``world.fields`` and writes go to ``world._out``, which
+    is the same dict except while ``World.update`` is double buffering.
+    '''
+
+    def __init__(self, name, default):
+        self.name = name
+        self.default = default
+
+    def __get__(self, cell, owner=None):
+        if cell is None:
+            return self.default
+        return cell.world.fields[self.name].item(cell.y, cell.x)
+
+    def __set__(self, cell, value):
+        world = cell.world
+        if self.name in world._watched:
+            world._set_watched(self.name, cell.x, cell.y, value)
+        else:
+            world._out[self.name][cell.y, cell.x] = value
+
+
+def get_fields(cell):
+    '''Return the array-backed attributes of a Cell class.
+
+    Every public, non-callable class attribute whose default is a bool,
+    number, string or None becomes a field.  Bools are stored as bool
+    arrays, numbers as float64 and everything else as object arrays.
+    '''
+    fields = {}
+    for klass in reversed(cell.__mro__):
+        if klass is object:
+            continue
+        for name, value in vars(klass).items():
+            if name.startswith('_') or name in ('x', 'y', 'world', 'agents'):
+                continue
+            if isinstance(value, Field):
+                value = value.default
+            elif not isinstance(value, (bool, int, float, str, type(None))):
+                fields.pop(name, None)
+                continue
+            if isinstance(value, bool):
+                dtype = bool
+            elif isinstance(value, (int, float)):
+                dtype = np.float64
+            else:
+                dtype = object
+            fields[name] = (dtype, value)
+    return fields
+
+
+_view_classes = {}
+
+
+def get_view_class(cell):
+    '''Return a subclass of `cell` whose fields are World array views.'''
+    view = _view_classes.get(cell)
+    if view is None:
+        attrs = dict((name, Field(name, default))
+                     for name, (dtype, default) in get_fields(cell).items())
+        attrs['__slots__'] = ()
+        view = type(cell.__name__, (cell,), attrs)
+        _view_classes[cell] = view
+    return view
+
+
+class CellIndex:
+    '''A set of row-major cell indices with O(1) add, remove and choice.'''
+
+    def __init__(self, indices=()):
+        self.items = [int(i) for i in indices]
+        self.positions = dict((i, k) for k, i in enumerate(self.items))
+        self.sorted = None
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, index):
+        return index in self.positions
+
+    def add(self, index):
+        if index not in self.positions:
+            self.positions[index] = len(self.items)
+            self.items.append(index)
+            self.sorted = None
+
+    def discard(self, index):
+        k = self.positions.pop(index, None)
+        if k is not None:
+            last = self.items.pop()
+            if last != index:
+                self.items[k] = last
+                self.positions[last] = k
+            self.sorted = None
+
+    def choice(self):
+        return self.items[random.randrange(len(self.items))]
+
+    def array(self):
+        '''Return the indices in row-major order.'''
+        if self.sorted is None:
+            self.sorted = np.sort(np.array(self.items, dtype=np.intp))
+        return self.sorted
+
+
+class CellBuckets:
+    '''A set of row-major cell indices filed by square blocks of cells.
+
+    Blocks are `size` cells across, so `near` only looks at the cells in
+    the blocks around the query point.
+    '''
+
+    def __init__(self, width, indices=(), size=8):
+        self.width = width
+        self.size = size
+        self.buckets = {}
+        for i in indices:
+            self.add(int(i))
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets.values())
+
+    def _key(self, index):
+        y, x = divmod(index, self.width)
+        return (x // self.size, y // self.size)
+
+    def add(self, index):
+        self.buckets.setdefault(self._key(index), {})[index] = None
+
+    def discard(self, index):
+        key = self._key(index)
+        bucket = self.buckets.get(key)
+        if bucket is not None:
+            bucket.pop(index, None)
+            if not bucket:
+                del self.buckets[key]
+
+    def near(self, x, y, radius):
+        '''Return an array of the indices within `radius` of (x, y).'''
+        size = self.size
+        x0, x1 = int((x - radius) // size), int((x + radius) // size)
+        y0, y1 = int((y - radius) // size), int((y + radius) // size)
+        found = []
+        for by in range(y0, y1 + 1):
+            for bx in range(x0, x1 + 1):
+                bucket = self.buckets.get((bx, by))
+                if bucket:
+                    found.extend(bucket)
+        found = np.array(found, dtype=np.intp)
+        cy, cx = np.divmod(found, self.width)
+        return found[(cx - x) ** 2 + (cy - y) ** 2 <= radius * radius]
+
+
+class CellChanges:
+    '''Collects the row-major indices of the Cells of a World that change.
+
+    Made by `World.track_changes`.  Cells that set a field are added as
+    they do, and update and restore add the cells they change; when the
+    World cannot tell which Cells changed, as when a field array is
+    written directly and then invalidated, `everything` is set instead.
+    The names of the fields that changed are kept in `fields`.
+    '''
+
+    def __init__(self):
+        self.changed = set()
+        self.fields = set()
+        self.everything = True
+
+    def take(self):
+        '''Return the indices changed since the last call, or None if
+        every Cell may have changed.'''
+        changed = self.changed
+        self.changed = set()
+        self.fields = set()
+        if self.everything:
+            self.everything = False
+            return None
+        return changed
+
+
+class Occupancy:
+    '''Tracks which Agents are in which cells of a World.
+
+    Agents are filed both by cell and by square buckets of `bucket_size`
+    cells, so moving an Agent is O(1) and `near` and `nearest` only look
+    at the Agents in the buckets around the query point.  Distances use
+    the Agents' ``x`` and ``y``.
+    '''
+
+    def __init__(self, width, height, bucket_size=8):
+        self.width = width
+        self.height = height
+        self.bucket_size = bucket_size
+        self.cells = {}
+        self.buckets = {}
+        self.location = {}
+
+    def add(self, agent, cell):
+        '''Put `agent` in `cell`, moving it if it is already tracked.'''
+        index = cell.y * self.width + cell.x
+        bucket = (cell.x // self.bucket_size, cell.y // self.bucket_size)
+        old = self.location.get(agent)
+        if old is not None:
+            if old[0] == index:
+                return
+            self._discard(self.cells, old[0], agent)
+            if old[1] != bucket:
+                self._discard(self.buckets, old[1], agent)
+                self.buckets.setdefault(bucket, {})[agent] = None
+        else:
+            self.buckets.setdefault(bucket, {})[agent] = None
+        self.cells.setdefault(index, {})[agent] = None
+        self.location[agent] = (index, bucket)
+
+    def remove(self, agent):
+        old = self.location.pop(agent, None)
+        if old is not None:
+            self._discard(self.cells, old[0], agent)
+            self._discard(self.buckets, old[1], agent)
+
+    def _discard(self, table, key, agent):
+        occupants = table[key]
+        del occupants[agent]
+        if not occupants:
+            del table[key]
+
+    def at(self, index):
+        '''Return a tuple of the Agents in the cell with row-major `index`.
+
+        It is a copy, so Agents are moved by setting their ``cell``.
+        '''
+        return tuple(self.cells.get(index, ()))
+
+    def near(self, x, y, radius, exclude=None):
+        '''Return the Agents within `radius` of (x, y).'''
+        size = self.bucket_size
+        # an Agent can be up to about a cell away from its cell's centre
+        reach = radius + 1
+        r2 = radius * radius
+        found = []
+        for by in range(int((y - reach) // size), int((y + reach) // size) + 1):
+            for bx in range(int((x - reach) // size), int((x + reach) // size) + 1):
+                for agent in self.buckets.get((bx, by), ()):
+                    if agent is exclude:
+                        continue
+                    if (agent.x - x) ** 2 + (agent.y - y) ** 2 <= r2:
+                        found.append(agent)
+        return found
+
+    def nearest(self, x, y, k=1, exclude=None):
+        '''Return up to `k` Agents closest to (x, y), nearest first.'''
+        limit = self.width + self.height
+        radius = self.bucket_size
+        while True:
+            found = self.near(x, y, radius, exclude=exclude)
+            if len(found) >= k or radius >= limit:
+                break
+            radius *= 2
+        found.sort(key=lambda a: (a.x - x) ** 2 + (a.y - y) ** 2)
+        return found[:k]
+
+
+class LazyGrid:
+    '''Row-major ``grid[y][x]`` access for a compact World.'''
+
+    def __init__(self, world):
+        self.world = world
+
+    def __len__(self):
+        return self.world.height
+
+    def __getitem__(self, y):
+        if y < 0:
+            y += self.world.height
+        if not 0 <= y < self.world.height:
+            raise IndexError(y)
+        return LazyRow(self.world, y)
+
+    def __iter__(self):
+        for y in range(self.world.height):
+            yield LazyRow(self.world, y)
+
+
+class LazyRow:
+    def __init__(self, world, y):
+        self.world = world
+        self.y = y
+
+    def __len__(self):
+        return self.world.width
+
+    def __getitem__(self, x):
+        if x < 0:
+            x += self.world.width
+        if not 0 <= x < self.world.width:
+            raise IndexError(x)
+        return self.world._get_view(x, self.y)
+
+    def __iter__(self):
+        for x in range(self.world.width):
+            yield self.world._get_view(x, self.y)
+
+
+class BitField:
+    '''A (height, width) bool field stored as one bit per cell.
+
+    Row y is packed into ``bits[y]`` eight cells to a byte, as
+    ``np.packbits`` does, so a 20000 x 20000 map takes 50MB.  The field is
+    indexed like the bool array it stands in for: ``field[y, x]`` and
+    ``field.item(y, x)`` by coordinates, ``field[i]`` and ``field.item(i)``
+    by row-major index, and either form of ``field[...]`` also takes
+    slices and index arrays.  A slice of a row only unpacks the bytes it
+    covers and a column is read without unpacking at all;
+    ``np.asarray(field)`` unpacks the whole field.
+    '''
+    dtype = np.dtype(bool)
+
+    def __init__(self, height, width, fill=False, bits=None):
+        self.shape = (height, width)
+        self.width = width
+        if bits is None:
+            bits = np.empty((height, (width + 7) // 8), dtype=np.uint8)
+            bits[:] = np.packbits(np.full(width, fill, dtype=bool))
+        self.bits = bits
+
+    @classmethod
+    def from_array(cls, array):
+        array = np.asarray(array, dtype=bool)
+        height, width = array.shape
+        return cls(height, width, bits=np.packbits(array, axis=1))
+
+    def __len__(self):
+        return self.shape[0]
+
+    def __array__(self, dtype=None, copy=None):
+        array = np.unpackbits(self.bits, axis=1, count=self.width).view(bool)
+        return array if dtype is None else array.astype(dtype)
+
+    def __invert__(self):
+        return ~np.asarray(self)
+
+    def astype(self, dtype):
+        return np.asarray(self).astype(dtype)
+
+    def copy(self):
+        return BitField(self.shape[0], self.width, bits=self.bits.copy())
+
+    def reshape(self, *shape):
+        # flat indexing works on the field itself
+        return self
+
+    def flatnonzero(self, invert=False):
+        '''Return the row-major indices of the set (or clear) cells.'''
+        rows = max(1, 2 ** 20 // self.width)
+        found = [np.zeros(0, dtype=np.intp)]
+        for y in range(0, self.shape[0], rows):
+            cells = np.unpackbits(self.bits[y:y + rows], axis=1,
+                                  count=self.width)
+            found.append(np.flatnonzero(cells != invert) + y * self.width)
+        return np.concatenate(found)
+
+    def _coordinates(self, key):
+        if isinstance(key, tuple):
+            return key
+        if isinstance(key, slice):
+            key = np.arange(self.shape[0] * self.width)[key]
+        return np.divmod(key, self.width)
+
+    def _columns(self, x):
+        if np.ndim(x) == 0:
+            return x + self.width if x < 0 else x
+        x = np.asarray(x)
+        return np.where(x < 0, x + self.width, x)
+
+    def item(self, *key):
+        if len(key) == 1:
+            y, x = divmod(key[0], self.width)
+        else:
+            y, x = key
+            if x < 0:
+                x += self.width
+        return bool(self.bits.item(y, x >> 3) & (128 >> (x & 7)))
+
+    def __getitem__(self, key):
+        y, x = self._coordinates(key)
+        if isinstance(x, slice):
+            start, stop, step = x.indices(self.width)
+            if step < 0:
+                cells = np.unpackbits(self.bits[y], axis=-1, count=self.width)
+                return cells[..., x].view(bool)
+            first = start >> 3
+            cells = np.unpackbits(self.bits[y, first:(stop + 7) >> 3], axis=-1)
+            start -= 8 * first
+            stop -= 8 * first
+            return cells[..., start:stop:step].view(bool)
+        x = self._columns(x)
+        return (self.bits[y, x >> 3] & (128 >> (x & 7))) != 0
+
+    def __setitem__(self, key, value):
+        y, x = self._coordinates(key)
+        if isinstance(y, slice) or isinstance(x, slice):
+            rows = np.arange(self.shape[0])[y]
+            columns = np.arange(self.width)[x]
+            if isinstance(y, slice) and np.ndim(columns):
+                rows = rows[:, None]
+            y, x = rows, columns
+        else:
+            x = self._columns(x)
+        if np.ndim(y) == 0 and np.ndim(x) == 0:
+            y = int(y)
+            x = int(x)
+            byte = self.bits.item(y, x >> 3)
+            mask = 128 >> (x & 7)
+            self.bits[y, x >> 3] = byte | mask if value else byte & ~mask
+            return
+        # ufunc.at, so that cells sharing a byte all get set
+        y, x = np.broadcast_arrays(y, x)
+        on = np.broadcast_to(np.asarray(value, dtype=bool), y.shape)
+        masks = (128 >> (x & 7)).astype(np.uint8)
+        np.bitwise_or.at(self.bits, (y[on], x[on] >> 3), masks[on])
+        np.bitwise_and.at(self.bits, (y[~on], x[~on] >> 3), ~masks[~on])
+
+
+class WallPyramid:
+    '''Counts of the walls in square blocks of cells, at every scale.
+
+    ``levels[k][by, bx]`` is the number of walls in the block of cells
+    ``size = base << k`` across whose top left cell is (bx * size,
+    by * size); the last level is a single block covering the whole map.
+    `base` is a power of two.  A ray or a region query can pass over a
+    block with no walls in one go, and `change` keeps the counts current
+    as walls are added or removed.
+    '''
+
+    def __init__(self, walls, base=8):
+        height, width = walls.shape
+        self.base = base
+        self.shift = base.bit_length() - 1
+        rows = -(-height // base)
+        columns = -(-width // base)
+        counts = np.zeros((rows, columns), dtype=np.min_scalar_type(base ** 2))
+        # count the walls a band of `base` rows at a time, so a BitField
+        # is never unpacked all at once
+        band = np.zeros((base, columns * base), dtype=counts.dtype)
+        for by in range(rows):
+            cells = walls[by * base:(by + 1) * base, :]
+            band[:len(cells), :width] = cells
+            band[len(cells):] = 0
+            counts[by] = band.reshape(base, columns, base).sum(axis=(0, 2))
+        self.levels = [counts]
+        size = base
+        while counts.shape != (1, 1):
+            size *= 2
+            rows, columns = counts.shape
+            coarse = np.zeros((rows + rows % 2, columns + columns % 2),
+                              dtype=np.min_scalar_type(size ** 2))
+            coarse[:rows, :columns] = counts
+            counts = coarse.reshape(len(coarse) // 2, 2, -1, 2).sum(
+                axis=(1, 3)).astype(coarse.dtype)
+            self.levels.append(counts)
+
+    def change(self, x, y, amount):
+        '''Add `amount` to the wall count of every block holding (x, y).'''
+        for k, counts in enumerate(self.levels):
+            i = y >> (self.shift + k)
+            j = x >> (self.shift + k)
+            counts[i, j] = counts.item(i, j) + amount
+
+    def empty_size(self, x, y):
+        '''Return the size of the largest empty block holding (x, y).
+
+        This is 0 if the smallest block holding the cell has a wall.
+        '''
+        size = 0
+        for k, counts in enumerate(self.levels):
+            if counts.item(y >> (self.shift + k), x >> (self.shift + k)):
+                break
+            size = self.base << k
+        return size
+
+    def any(self, walls, x0, y0, x1, y1):
+        '''Return whether `walls` has a wall from (x0, y0) to (x1, y1).
+
+        The corners are inclusive.  Empty blocks are passed over and a
+        block inside the region with a wall in it settles the answer, so
+        only cells near the edge of the region are looked at in `walls`.
+        '''
+        height, width = walls.shape
+        x0 = max(x0, 0)
+        y0 = max(y0, 0)
+        x1 = min(x1, width - 1)
+        y1 = min(y1, height - 1)
+        if x0 > x1 or y0 > y1:
+            return False
+        blocks = [(len(self.levels) - 1, 0, 0)]
+        while blocks:
+            k, bx, by = blocks.pop()
+            if not self.levels[k].item(by, bx):
+                continue
+            size = self.base << k
+            left = bx * size
+            top = by * size
+            right = min(left + size, width) - 1
+            bottom = min(top + size, height) - 1
+            if x0 <= left and right <= x1 and y0 <= top and bottom <= y1:
+                return True
+            if k == 0:
+                if walls[max(y0, top):min(y1, bottom) + 1,
+                         max(x0, left):min(x1, right) + 1].any():
+                    return True
+                continue
+            rows, columns = self.levels[k - 1].shape
+            half = size // 2
+            for cy in (2 * by, 2 * by + 1):
+                for cx in (2 * bx, 2 * bx + 1):
+                    if (cy < rows and cx < columns and
+                            cx * half <= x1 and (cx + 1) * half > x0 and
+                            cy * half <= y1 and (cy + 1) * half > y0):
+                        blocks.append((k - 1, cx, cy))
+        return False
+
+
+def copy_field(out, field):
+    '''Copy the values of the field array `field` into `out`.'''
+    if isinstance(out, BitField):
+        out.bits[...] = field.bits
+    else:
+        np.copyto(out, field)
+
+
+def fields_equal(a, b):
+    '''Return whether two field arrays of the same kind are equal.'''
+    if isinstance(a, BitField):
+        return np.array_equal(a.bits, b.bits)
+    return np.array_equal(a, b)
+
+
+class NeighbourTable:
+    '''World.neighbour_table worked out on demand rather than stored.'''
+
+    def __init__(self, world):
+        self.width = world.width
+        self.height = world.height
+        self.offsets = world.offsets
+        self.array_offsets = np.array([world.offsets[0], world.offsets[1]])
+        self.shape = (world.width * world.height, world.directions)
+
+    def __len__(self):
+        return self.shape[0]
+
+    def item(self, index, dir):
+        index = self._check(index)
+        y, x = divmod(index, self.width)
+        dx, dy = self.offsets[y % 2][dir]
+        return ((y + dy) % self.height) * self.width + (x + dx) % self.width
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            index = np.arange(*index.indices(len(self)))
+        y, x = np.divmod(self._check(np.asarray(index)), self.width)
+        offsets = self.array_offsets[y % 2]
+        return (((y[..., None] + offsets[..., 1]) % self.height) * self.width +
+                (x[..., None] + offsets[..., 0]) % self.width)
+
+    def __array__(self, dtype=None, copy=None):
+        # the whole table, for NumPy code such as Cell kernels that index
+        # with it; it is as big as the one a normal World stores
+        n = len(self)
+        table = self[np.arange(n)].astype(
+            np.int32 if n < 2 ** 31 else np.int64)
+        return table if dtype is None else table.astype(dtype)
+
+    def _check(self, index):
+        # indices wrap from the end like an array's, but out of range ones
+        # must not wrap around the map
+        n = len(self)
+        if np.any((index < -n) | (index >= n)):
+            raise IndexError('cell index out of range for %d cells' % n)
+        return index % n
+
+
+map_magic = b'PMWORLD1'
+
+
+def get_class_key(cell):
+    '''Return a digest that changes whenever the code of `cell` does.
+
+    It covers the source of the Cell class and of its bases, where the
+    source can be found, and the byte code of their methods and of the
+    functions those call by name, so that a map compiled with one version
+    of a Cell class is not loaded with another.
+    '''
+    key = hashlib.sha1()
+    seen = set()
+    for klass in cell.__mro__:
+        if klass is object:
+            continue
+        try:
+            source = inspect.getsource(klass)
+        except (OSError, TypeError):
+            source = ''
+        key.update(('%s.%s\n%s' % (klass.__module__, klass.__qualname__,
+                                   source)).encode('utf-8'))
+        for name, value in sorted(vars(klass).items()):
+            if isinstance(value, (staticmethod, classmethod)):
+                value = value.__func__
+            if isinstance(value, property):
+                functions = (value.fget, value.fset, value.fdel)
+            else:
+                functions = (value,)
+            for function in functions:
+                if isinstance(function, types.FunctionType):
+                    _hash_function(key, function, seen)
+    return key.hexdigest()
+
+
+def _hash_function(key, function, seen):
+    # the byte code of `function` and of the global functions it calls
+    if function in seen:
+        return
+    seen.add(function)
+    names = []
+    _hash_code(key, function.__code__, names)
+    for name in names:
+        value = function.__globals__.get(name)
+        if isinstance(value, types.FunctionType):
+            _hash_function(key, value, seen)
+
+
+def _hash_code(key, code, names):
+    key.update(code.co_code)
+    key.update(repr(code.co_names).encode('utf-8'))
+    names.extend(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _hash_code(key, const, names)
+        else:
+            key.update(repr(const).encode('utf-8'))
+
+
+def save_compiled_map(path, fields, defaults):
+    '''Write field arrays to `path` in a memory-mappable binary format.
+
+    The file holds a pickled header followed by the raw bool and float
+    arrays, each aligned to 64 bytes.  Object fields are stored in the
+    header as {index: value} for the cells that differ from `defaults`.
+    '''
+    shape = fields['wall'].shape
+    header = {'shape': shape, 'arrays': [], 'objects': {}}
+    blocks = []
+    offset = 0
+    for name, array in fields.items():
+        if array.dtype == object:
+            changed = np.flatnonzero(array.reshape(-1) != defaults[name])
+            header['objects'][name] = dict(
+                (int(i), array.item(i)) for i in changed)
+            continue
+        data = np.ascontiguousarray(array).tobytes()
+        header['arrays'].append((name, array.dtype.str, offset))
+        blocks.append(data)
+        offset += len(data)
+        offset += -offset % 64
+        blocks.append(b'\0' * (-len(data) % 64))
+    head = pickle.dumps(header, protocol=2)
+    start = len(map_magic) + 8 + len(head)
+    start += -start % 64
+    directory = os.path.dirname(path)
+    fd, tmp = tempfile.mkstemp(dir=directory or '.')
+    with os.fdopen(fd, 'wb') as f:
+        f.write(map_magic)
+        f.write(np.uint64(start).tobytes())
+        f.write(head)
+        f.write(b'\0' * (start - len(map_magic) - 8 - len(head)))
+        for block in blocks:
+            f.write(block)
+    os.replace(tmp, path)
+
+
+def load_compiled_map(path, defaults):
+    '''Memory-map the field arrays written by `save_compiled_map`.
+
+    Arrays are mapped copy-on-write, so changing a Cell only touches the
+    pages it changes and never the file.
+    '''
+    with open(path, 'rb') as f:
+        if f.read(len(map_magic)) != map_magic:
+            raise CellularException('%s is not a compiled map' % path)
+        start = int(np.frombuffer(f.read(8), dtype=np.uint64)[0])
+        header = pickle.loads(f.read(start - len(map_magic) - 8))
+    fields = {}
+    shape = header['shape']
+    for name, dtype, offset in header['arrays']:
+        fields[name] = np.memmap(path, dtype=dtype, mode='c',
+                                 offset=start + offset, shape=shape)
+    for name, values in header['objects'].items():
+        array = np.full(shape, defaults[name], dtype=object)
+        flat = array.reshape(-1)
+        for i, value in values.items():
+            flat[i] = value
+        fields[name] = array
+    return fields
+
+
 class World:
-    def __init__(self, cell=None, width=None, height=None, directions=8, filename=None, map=None):
+    '''A grid of Cells with Agents moving around in it.
+
+    Cell attributes with a simple class-level default (``wall``,
+    ``food``, ...) are stored as NumPy arrays in
+    ``self.fields``, one (height, width) array per attribute, and the
+    Cells in ``self.grid`` are views onto them.  With ``compact=True`` the
+    Cells are only created when they are accessed and are dropped again
+    once nothing refers to them, so only the arrays take up memory;
+    attributes other than fields do not persist on compact Cells.
+    ``Cell.__init__`` is only run for the Cells of a World that starts
+    out empty and is not compact, so it should not do more than set
+    fields to the values a map is loaded over: compact Cells and the
+    Cells of a cached map are made without it.  ``cell.agents`` is a
+    tuple of the Agents in a Cell, made when it is read.
+
+    With ``packed=True`` bool fields are stored as BitFields, one bit per
+    cell, and neighbours are worked out as they are needed rather than
+    kept in a table, so a large compact World takes little more than a
+    bit per cell for each bool field (tables over the whole map, such as
+    `get_wall_distances`, are not built).  `walls` gives the wall field
+    directly, as a bool array or BitField such as the ones made by
+    ``maze.generateWalls``, and sets the size of the World.
+
+    If `cache_dir` is set (or the ``World.cache_dir`` class attribute),
+    loaded maps are compiled into a binary file in that directory, keyed
+    by a hash of the map text, the code and fields of the Cell class (see
+    `get_class_key`) and the world size, and
+    later loads of the same map memory-map that file instead of calling
+    ``Cell.load`` for every character.  Maps whose Cells set attributes
+    other than fields in ``load`` are not cached.
+    '''
+    # the Cell class used when none is given
+    Cell = Cell
+
+    cache_dir = None
+
+    # radar() traces fewer rays than this one at a time, which is faster
+    # than setting up the batched arrays
+    radar_batch = 64
+
+    # whether tables covering the whole map (get_wall_distances,
+    # get_distance_field) may be built
+    map_tables = True
+
+    # how many distance fields get_distance_field keeps
+    distance_fields = 16
+
+    # rays longer than this skip over empty space with the wall pyramid
+    pyramid_distance = 32
+
+    def __init__(self, cell=None, width=None, height=None, directions=8, filename=None, map=None,
+                 compact=False, cache_dir=None, packed=False, walls=None):
         if cell is None:
-            cell = Cell
+            cell = self.Cell
         self.Cell = cell
         self.directions = directions
+        self.offsets = direction_offsets[directions]
+        self.compact = compact
+        self.packed = packed
+        if packed:
+            self.map_tables = False
+        if cache_dir is not None:
+            self.cache_dir = cache_dir
+        lines = None
         if filename or map:
-            if filename:
-                data = open(filename).readlines()
-            else:
-                data = map.splitlines()
-                if len(data[0]) == 0:
-                    del data[0]
+            lines = self._read_map(filename, map)
             if height is None:
-                height = len(data)
+                height = len(lines)
             if width is None:
-                width = max([len(x.rstrip()) for x in data])
+                width = max([len(x) for x in lines])
+        if walls is not None:
+            height, width = walls.shape
         if width is None:
             width = 20
         if height is None:
@@ -134,33 +948,277 @@ class World:
         self.width = width
         self.height = height
         self.image = None
-        self.reset()
-        if filename or map:
-            self.load(filename=filename, map=map)
+        if walls is not None:
+            self.reset(walls=walls)
+        elif lines is not None and hasattr(self.Cell, 'load'):
+            self._load_lines(lines)
+        else:
+            self.reset()
 
     def get_cell(self, x, y):
         return self.grid[y][x]
 
     def find_cells(self, filter):
+        '''Yield the Cells for which `filter(cell)` is true.
+
+        `filter` can also be the name of a field (or ``'free'`` for cells
+        without a wall), in which case the matching Cells come from an
+        index that is kept up to date as the field is set.
+        '''
+        if isinstance(filter, str):
+            for i in self.get_index(filter).array().tolist():
+                yield self.get_cell_at(i)
+            return
         for row in self.grid:
             for cell in row:
                 if filter(cell):
                     yield cell
 
-    def reset(self):
-        self.grid = [[self._make_cell(
-            i, j) for i in range(self.width)] for j in range(self.height)]
-        self.dictBackup = [[{} for i in range(self.width)]
-                           for j in range(self.height)]
+    def where(self, name):
+        '''Return the (x, y) coordinate arrays of the cells with `name` set.'''
+        y, x = np.divmod(self.get_index(name).array(), self.width)
+        return x, y
+
+    def count(self, name):
+        '''Return the number of cells with `name` set.'''
+        return len(self.get_index(name))
+
+    def get_index(self, name):
+        '''Return the CellIndex of the cells with field `name` set.
+
+        Indices are built on first use and then updated whenever a Cell
+        sets the field.  Call `invalidate` after writing to ``self.fields``
+        directly.
+        '''
+        index = self._indexes.get(name)
+        if index is None:
+            index = CellIndex(self._find_indices(name))
+            self._indexes[name] = index
+            self._watched.add('wall' if name == 'free' else name)
+        return index
+
+    def get_buckets(self, name):
+        '''Return the CellBuckets of the cells with field `name` set.
+
+        Like `get_index`, the buckets are built on first use and then kept
+        up to date as Cells set the field.
+        '''
+        buckets = self._buckets.get(name)
+        if buckets is None:
+            buckets = CellBuckets(self.width, self._find_indices(name))
+            self._buckets[name] = buckets
+            self._watched.add(name)
+        return buckets
+
+    def track_changes(self):
+        '''Return a CellChanges that collects the Cells changed from now on.
+
+        While any are being collected, every field is watched, so setting
+        a field through a Cell is a little slower.
+        '''
+        changes = CellChanges()
+        self._changes.append(changes)
+        self._watched.update(self.fields)
+        return changes
+
+    def untrack_changes(self, changes):
+        '''Stop collecting `changes`, made by `track_changes`.'''
+        if changes in self._changes:
+            self._changes.remove(changes)
+            self._update_watched()
+
+    def _find_indices(self, name):
+        field = self.fields['wall' if name == 'free' else name]
+        if isinstance(field, BitField):
+            return field.flatnonzero(invert=name == 'free')
+        if name == 'free':
+            mask = ~self.fields['wall']
+        else:
+            mask = self.fields[name].astype(bool)
+        return np.flatnonzero(mask)
+
+    def invalidate(self, name=None, changed=None):
+        '''Drop what is derived from field `name` (or from all fields).
+
+        This is the cell indexes and, for walls, the tables cached by
+        methods such as `get_wall_distances`.  `changed` holds the
+        row-major indices of the cells that changed, when they are known,
+        for the CellChanges being collected.
+        '''
+        if name is None:
+            self._indexes.clear()
+            self._buckets.clear()
+        else:
+            self._indexes.pop(name, None)
+            self._buckets.pop(name, None)
+            if name == 'wall':
+                self._indexes.pop('free', None)
+        if name is None or name == 'wall':
+            self._wall_cache.clear()
+            self._pyramid = None
+        for changes in self._changes:
+            if changed is None:
+                changes.everything = True
+            else:
+                changes.changed.update(changed.tolist())
+            changes.fields.add(name)
+        self._update_watched()
+
+    def _update_watched(self):
+        # the fields whose Cell setters have indexes or CellChanges to keep
+        # up to date
+        self._watched = set('wall' if n == 'free' else n
+                            for n in self._indexes)
+        self._watched.update(self._buckets)
+        self._watched.add('wall')
+        if self._changes:
+            self._watched.update(self.fields)
+
+    def _reindex(self, name, cells):
+        # update the index and buckets of field `name` for the cells (row-
+        # major indices) whose values changed, and the CellChanges
+        values = self.fields[name].reshape(-1)[cells].tolist()
+        cells = cells.tolist()
+        for index in (self._indexes.get(name), self._buckets.get(name)):
+            if index is not None:
+                for i, value in zip(cells, values):
+                    if value:
+                        index.add(i)
+                    else:
+                        index.discard(i)
+        for changes in self._changes:
+            changes.changed.update(cells)
+            changes.fields.add(name)
+
+    def _invalidate_changed(self, old):
+        for name, array in self.fields.items():
+            if not fields_equal(array, old[name]):
+                self.invalidate(name, self._changed_cells(array, old[name]))
+
+    def _changed_cells(self, a, b):
+        # the cells where two versions of a field differ, if anyone is
+        # collecting CellChanges
+        if not self._changes:
+            return None
+        return np.flatnonzero(np.asarray(a) != np.asarray(b))
+
+    def _set_watched(self, name, x, y, value):
+        array = self._out[name]
+        before = array.item(y, x)
+        array[y, x] = value
+        after = array.item(y, x)
+        if before == after or array is not self.fields[name]:
+            return
+        i = y * self.width + x
+        for changes in self._changes:
+            changes.changed.add(i)
+            changes.fields.add(name)
+        on = bool(after)
+        if name == 'wall':
+            self._wall_cache.clear()
+            if self._pyramid is not None:
+                self._pyramid.change(x, y, 1 if on else -1)
+        for index in (self._indexes.get(name), self._buckets.get(name)):
+            if index is not None:
+                if on:
+                    index.add(i)
+                else:
+                    index.discard(i)
+        if name == 'wall':
+            index = self._indexes.get('free')
+            if index is not None:
+                if on:
+                    index.discard(i)
+                else:
+                    index.add(i)
+
+    def reset(self, fields=None, walls=None):
+        self._view_class = get_view_class(self.Cell)
+        initialise = fields is None
+        if fields is None:
+            fields = {}
+            for name, (dtype, default) in get_fields(self.Cell).items():
+                if name == 'wall' and walls is not None:
+                    if not self.packed:
+                        walls = np.array(walls, dtype=bool)
+                    fields[name] = walls
+                elif self.packed and dtype is bool:
+                    fields[name] = BitField(self.height, self.width, default)
+                elif default == 0 and dtype is not object:
+                    # the pages of a zeroed array only take up memory once
+                    # they are written to
+                    fields[name] = np.zeros((self.height, self.width),
+                                            dtype=dtype)
+                else:
+                    fields[name] = np.full((self.height, self.width), default,
+                                           dtype=dtype)
+        if self.packed:
+            for name, array in fields.items():
+                if array.dtype == bool and not isinstance(array, BitField):
+                    fields[name] = BitField.from_array(array)
+        self.fields = fields
+        self._out = self.fields
+        self._back = None
+        self._indexes = {}
+        self._buckets = {}
+        self._watched = set(['wall'])
+        self._wall_cache = {}
+        self._pyramid = None
+        self._changes = getattr(self, '_changes', [])
+        for changes in self._changes:
+            changes.everything = True
+            self._watched.update(self.fields)
+        if self.compact:
+            self._views = weakref.WeakValueDictionary()
+            self.grid = LazyGrid(self)
+        else:
+            # Cell.__init__ sets up new Cells, so it must not run over fields
+            # that already hold a map, such as ones from the map cache
+            self.grid = [[self._make_cell(
+                i, j, initialise) for i in range(self.width)]
+                for j in range(self.height)]
+            self.cells = [c for row in self.grid for c in row]
+        if self.packed:
+            self.neighbour_table = NeighbourTable(self)
+        else:
+            self.neighbour_table = self._make_neighbour_table()
+        self.dictBackup = None
+        self.occupancy = Occupancy(self.width, self.height)
         self.agents = []
         self.age = 0
 
-    def _make_cell(self, x, y):
-        c = self.Cell()
+    def _make_cell(self, x, y, initialise=False):
+        c = self._view_class.__new__(self._view_class)
         c.x = x
         c.y = y
         c.world = self
-        c.agents = []
+        if initialise:
+            c.__init__()
+        return c
+
+    def _make_neighbour_table(self):
+        # neighbour_table[y * width + x, dir] is the row-major index of the
+        # cell next to (x, y) in direction dir, wrapping around the edges
+        ys, xs = np.divmod(np.arange(self.width * self.height), self.width)
+        offsets = np.array(self.offsets)[ys % 2]
+        nx = (xs[:, None] + offsets[:, :, 0]) % self.width
+        ny = (ys[:, None] + offsets[:, :, 1]) % self.height
+        dtype = np.int32 if len(xs) < 2 ** 31 else np.int64
+        return (ny * self.width + nx).astype(dtype)
+
+    def get_cell_at(self, index):
+        '''Return the Cell with the given row-major index.'''
+        if self.compact:
+            y, x = divmod(index, self.width)
+            return self._get_view(x, y)
+        return self.cells[index]
+
+    def _get_view(self, x, y):
+        key = y * self.width + x
+        c = self._views.get(key)
+        if c is None:
+            c = self._make_cell(x, y)
+            self._views[key] = c
         return c
 
     def randomize(self):
@@ -191,48 +1249,106 @@ class World:
     def load(self, filename=None, map=None):
         if not hasattr(self.Cell, 'load'):
             return
+        self._load_lines(self._read_map(filename, map))
+
+    def _read_map(self, filename=None, map=None):
         if filename:
             if isinstance(filename, type('')):
-                filename = open(filename)
-            lines = filename.readlines()
+                with open(filename) as f:
+                    lines = f.readlines()
+            else:
+                lines = filename.readlines()
         else:
             lines = map.splitlines()
             if len(lines[0]) == 0:
                 del lines[0]
-        lines = [x.rstrip() for x in lines]
+        return [x.rstrip() for x in lines]
+
+    def _load_lines(self, lines):
+        path = None
+        if self.cache_dir is not None:
+            path = os.path.join(self.cache_dir,
+                                self._get_map_key(lines) + '.pmworld')
+            if os.path.exists(path):
+                defaults = dict((name, default) for name, (dtype, default)
+                                in get_fields(self.Cell).items())
+                self.reset(fields=load_compiled_map(path, defaults))
+                return
+
         fh = len(lines)
         fw = max([len(x) for x in lines])
         if fh > self.height:
             fh = self.height
             starty = 0
         else:
-            starty = (self.height - fh) / 2
+            starty = int((self.height - fh) / 2)
         if fw > self.width:
             fw = self.width
             startx = 0
         else:
-            startx = (self.width - fw) / 2
+            startx = int((self.width - fw) / 2)
 
         self.reset()
         for j in range(fh):
             line = lines[j]
             for i in range(min(fw, len(line))):
-                y = int(starty + j)
-                x = int(startx + i)
-                self.grid[y][x].load(line[i])
+                self.grid[starty + j][startx + i].load(line[i])
+
+        if path is not None and self._only_fields_loaded():
+            if not os.path.isdir(self.cache_dir):
+                os.makedirs(self.cache_dir)
+            defaults = dict((name, default) for name, (dtype, default)
+                            in get_fields(self.Cell).items())
+            save_compiled_map(path, self.fields, defaults)
+
+    def _get_map_key(self, lines):
+        fields = sorted((name, np.dtype(dtype).str, default) for name,
+                        (dtype, default) in get_fields(self.Cell).items())
+        key = hashlib.sha1()
+        for part in (map_magic, get_class_key(self.Cell), repr(fields),
+                     repr((self.width, self.height)), '\n'.join(lines)):
+            if not isinstance(part, bytes):
+                part = part.encode('utf-8')
+            key.update(part)
+        return key.hexdigest()
+
+    def _only_fields_loaded(self):
+        if self.compact:
+            return True
+        for row in self.grid:
+            for c in row:
+                if getattr(c, '__dict__', None):
+                    return False
+        return True
 
     def update(self):
-        if hasattr(self.Cell, 'update'):
-            for j, row in enumerate(self.grid):
-                for i, c in enumerate(row):
-                    self.dictBackup[j][i].update(c.__dict__)
-                    c.update()
-                    c.__dict__, self.dictBackup[j][
-                        i] = self.dictBackup[j][i], c.__dict__
-            for j, row in enumerate(self.grid):
-                for i, c in enumerate(row):
-                    c.__dict__, self.dictBackup[j][
-                        i] = self.dictBackup[j][i], c.__dict__
+        '''Advance every Cell and Agent by one step.
+
+        A Cell class can describe its update rule as a NumPy kernel by
+        defining ``kernel(world, state, out)``, which is called once per
+        step with two dicts of flat (width * height) field arrays: the
+        current ``state`` to read from and the ``out`` buffer to write the
+        next state into.  ``out`` starts as a copy of ``state`` and
+        ``world.neighbour_table`` indexes ``state`` by neighbour, e.g.
+        ``state['food'][world.neighbour_table].any(axis=1)``.  Otherwise a
+        Cell ``update()`` method is called on every Cell.
+        '''
+        kernel = getattr(self.Cell, 'kernel', None)
+        if kernel is not None or hasattr(self.Cell, 'update'):
+            # fields are double buffered: the next state is written into
+            # the back buffer, which is swapped in once the step is done
+            back = self._get_back_buffer()
+            if kernel is not None:
+                kernel(self, self._flatten(self.fields), self._flatten(back))
+            else:
+                self._out = back
+                try:
+                    self._update_cells()
+                finally:
+                    self._out = self.fields
+            self.fields, self._back = back, self.fields
+            self._out = self.fields
+            self._invalidate_changed(self._back)
             for a in self.agents:
                 a.update()
         else:
@@ -241,20 +1357,40 @@ class World:
                 a.update()
         self.age += 1
 
+    def _get_back_buffer(self):
+        back = getattr(self, '_back', None)
+        if back is None or back.keys() != self.fields.keys():
+            back = dict((k, v.copy()) for k, v in self.fields.items())
+        for k, v in self.fields.items():
+            copy_field(back[k], v)
+        return back
+
+    def _flatten(self, fields):
+        return dict((k, v.reshape(-1)) for k, v in fields.items())
+
+    def _update_cells(self):
+        # Cells without a __dict__ have nothing but fields to double buffer
+        if self.compact or not hasattr(self.cells[0], '__dict__'):
+            for row in self.grid:
+                for c in row:
+                    c.update()
+            return
+        if self.dictBackup is None:
+            self.dictBackup = [[{} for i in range(self.width)]
+                               for j in range(self.height)]
+        for j, row in enumerate(self.grid):
+            for i, c in enumerate(row):
+                self.dictBackup[j][i].update(c.__dict__)
+                c.update()
+                c.__dict__, self.dictBackup[j][
+                    i] = self.dictBackup[j][i], c.__dict__
+        for j, row in enumerate(self.grid):
+            for i, c in enumerate(row):
+                c.__dict__, self.dictBackup[j][
+                    i] = self.dictBackup[j][i], c.__dict__
+
     def get_offset_in_direction(self, x, y, dir):
-        if self.directions == 8:
-            dx, dy = [(0, -1), (1, -1), (
-                1, 0), (1, 1), (0, 1), (-1, 1), (-1, 0), (-1, -1)][dir]
-        elif self.directions == 4:
-            dx, dy = [(0, -1), (1, 0), (0, 1), (-1, 0)][dir]
-        elif self.directions == 6:
-            if y % 2 == 0:
-                dx, dy = [(1, 0), (0, 1), (-1, 1), (-1, 0),
-                          (-1, -1), (0, -1)][dir]
-            else:
-                dx, dy = [(1, 0), (1, 1), (0, 1), (-1, 0),
-                          (0, -1), (1, -1)][dir]
-        return dx, dy
+        return self.offsets[y % 2][dir]
 
     def get_point_in_direction(self, x, y, dir):
         dx, dy = self.get_offset_in_direction(x, y, dir)
@@ -273,6 +1409,467 @@ class World:
 
         return (x2, y2)
 
+    def cast_ray(self, x, y, dx, dy, max_distance=None):
+        '''Find the first wall along the ray (x, y) + t * (dx, dy).
+
+        Cells are treated as unit squares centred on their coordinates and
+        the ray is traced one cell boundary at a time (a DDA grid
+        traversal), so the cost is proportional to the number of cells
+        crossed.  Returns ``(t, cell)`` for the wall the ray enters first,
+        or ``(max_distance, None)`` if it reaches neither a wall nor the
+        edge of the map before ``t == max_distance``.  Nothing is changed,
+        so rays can be cast from any thread.
+        '''
+        walls = self.fields['wall']
+        width = self.width
+        height = self.height
+        if max_distance is None:
+            max_distance = width + height
+        pyramid = None
+        if (self.pyramid_distance is not None and
+                max_distance > self.pyramid_distance):
+            pyramid = self.get_wall_pyramid()
+            shift = pyramid.shift
+            block = None
+        cx = int(math.floor(x + 0.5))
+        cy = int(math.floor(y + 0.5))
+        if not (0 <= cx < width and 0 <= cy < height):
+            return max_distance, None
+        if walls.item(cy, cx):
+            return 0.0, self.get_cell(cx, cy)
+
+        if dx > 0:
+            step_x, next_x, delta_x = 1, (cx + 0.5 - x) / dx, 1.0 / dx
+        elif dx < 0:
+            step_x, next_x, delta_x = -1, (cx - 0.5 - x) / dx, -1.0 / dx
+        else:
+            step_x, next_x, delta_x = 0, float('inf'), 0.0
+        if dy > 0:
+            step_y, next_y, delta_y = 1, (cy + 0.5 - y) / dy, 1.0 / dy
+        elif dy < 0:
+            step_y, next_y, delta_y = -1, (cy - 0.5 - y) / dy, -1.0 / dy
+        else:
+            step_y, next_y, delta_y = 0, float('inf'), 0.0
+
+        while True:
+            if pyramid is not None and (cx >> shift, cy >> shift) != block:
+                block = (cx >> shift, cy >> shift)
+                size = pyramid.empty_size(cx, cy)
+                if size:
+                    # the ray only passes empty cells until it leaves this
+                    # block, so go straight to the last cell in it
+                    kx = self._crossings_in_block(cx, step_x, size)
+                    ky = self._crossings_in_block(cy, step_y, size)
+                    exit_x = next_x + kx * delta_x if step_x else next_x
+                    exit_y = next_y + ky * delta_y if step_y else next_y
+                    t = min(exit_x, exit_y)
+                    if t >= max_distance:
+                        return max_distance, None
+                    # count the crossings of the other axis before the exit
+                    if step_x and exit_x != t:
+                        kx = self._crossings_before(next_x, delta_x, kx, t)
+                    if step_y and exit_y != t:
+                        ky = self._crossings_before(next_y, delta_y, ky, t)
+                    cx += step_x * kx
+                    cy += step_y * ky
+                    next_x += kx * delta_x
+                    next_y += ky * delta_y
+
+            # a ray passing exactly through a corner goes straight on
+            # into the diagonal cell
+            t = min(next_x, next_y)
+            if next_x == t:
+                cx += step_x
+                next_x += delta_x
+            if next_y == t:
+                cy += step_y
+                next_y += delta_y
+            if t >= max_distance:
+                return max_distance, None
+            if not (0 <= cx < width and 0 <= cy < height):
+                return max_distance, None
+            if walls.item(cy, cx):
+                return t, self.get_cell(cx, cy)
+
+    @staticmethod
+    def _crossings_in_block(c, step, size):
+        # how many boundaries the ray crosses along one axis before it
+        # reaches the edge of the block of `size` cells holding c
+        if step > 0:
+            return size - 1 - c % size
+        if step < 0:
+            return c % size
+        return 0
+
+    @staticmethod
+    def _crossings_before(next, delta, most, t):
+        # how many of the first `most` boundaries are crossed before time t
+        k = min(max(int(math.ceil((t - next) / delta)), 0), most)
+        while k > 0 and next + (k - 1) * delta >= t:
+            k -= 1
+        while k < most and next + k * delta < t:
+            k += 1
+        return k
+
+    def radar(self, xs, ys, dirs, angles, max_distance=None):
+        '''Cast a fan of rays from each of a set of poses at once.
+
+        `xs`, `ys` and `dirs` give one pose per agent and `angles` the ray
+        directions relative to each agent's `dir`, in the same units as
+        `dir`.  `angles` may also be an (agents, rays) array, and
+        `max_distance` a scalar, one value per ray or an (agents, rays)
+        array.  Returns an (agents, rays) array of the distances
+        `Agent.detect` would give, with every ray traced together.
+        '''
+        width = self.width
+        height = self.height
+        directions = self.directions
+        if max_distance is None:
+            max_distance = width + height
+
+        xs = np.asarray(xs, dtype=float).reshape(-1, 1)
+        ys = np.asarray(ys, dtype=float).reshape(-1, 1)
+        dirs = np.asarray(dirs, dtype=float).reshape(-1, 1)
+        angles = np.atleast_1d(np.asarray(angles, dtype=float))
+        dir = (dirs + angles) % directions
+        shape = dir.shape
+        zeros = np.zeros(shape)
+        limits = (zeros + max_distance).ravel()
+        x = (zeros + xs).ravel()
+        y = (zeros + ys).ravel()
+        dir = dir.ravel()
+
+        # long rays are cast one at a time, so they can skip empty space
+        if len(dir) < self.radar_batch or (
+                self.pyramid_distance is not None and
+                limits.max() > self.pyramid_distance):
+            distance = [self._cast_radar_ray(*ray) for ray in
+                        zip(x.tolist(), y.tolist(), dir.tolist(),
+                            limits.tolist())]
+            return np.array(distance).reshape(shape)
+
+        cx = np.floor(x + 0.5).astype(np.intp)
+        cy = np.floor(y + 0.5).astype(np.intp)
+
+        # the direction vectors, blended between whole directions the same
+        # way ContinuousAgent.get_direction_vector does
+        offsets = np.array([self.offsets[0], self.offsets[1]], dtype=float)
+        dir1 = np.floor(dir).astype(np.intp) % directions
+        dir2 = (dir1 + 1) % directions
+        scale = (dir % 1)[:, None]
+        parity = cy % 2
+        vector = offsets[parity, dir2]*scale + offsets[parity, dir1]*(1 - scale)
+        dx = vector[:, 0]
+        dy = vector[:, 1]
+
+        # the times at which each ray crosses vertical and horizontal cell
+        # boundaries, as in cast_ray: the k-th vertical boundary is crossed
+        # at next_x + k * delta_x.  No ray can cross more than `steps` of
+        # either before reaching max_distance or leaving the map.
+        rays = len(dir)
+        span = min(float(limits.max()) * float(np.abs(vector).max()),
+                   max(width, height))
+        steps = int(math.ceil(span)) + 1
+        with np.errstate(divide='ignore'):
+            delta_x = np.where(dx != 0, 1.0 / np.abs(dx), 0.0)
+            delta_y = np.where(dy != 0, 1.0 / np.abs(dy), 0.0)
+        next_x = np.where(dx > 0, cx + 0.5 - x, x - (cx - 0.5)) * delta_x
+        next_y = np.where(dy > 0, cy + 0.5 - y, y - (cy - 0.5)) * delta_y
+        next_x[dx == 0] = np.inf
+        next_y[dy == 0] = np.inf
+        k = np.arange(steps)
+        times = np.concatenate((next_x[:, None] + k * delta_x[:, None],
+                                next_y[:, None] + k * delta_y[:, None]),
+                               axis=1)
+
+        # walk every ray's crossings in order, counting the steps taken
+        # along each axis to find the cell entered at each crossing
+        order = np.argsort(times, axis=1, kind='stable')
+        times = np.take_along_axis(times, order, axis=1)
+        along_x = order < steps
+        cells_x = cx[:, None] + np.sign(dx).astype(np.intp)[:, None] * \
+            np.cumsum(along_x, axis=1)
+        cells_y = cy[:, None] + np.sign(dy).astype(np.intp)[:, None] * \
+            np.cumsum(~along_x, axis=1)
+
+        # a ray passing exactly through a corner crosses both boundaries at
+        # once and goes straight on into the diagonal cell; once a ray has
+        # left the map it cannot come back
+        entered = np.ones(times.shape, dtype=bool)
+        entered[:, :-1] = times[:, 1:] != times[:, :-1]
+        entered &= times < limits[:, None]
+        entered &= ((cells_x >= 0) & (cells_x < width) &
+                    (cells_y >= 0) & (cells_y < height))
+
+        walls = self.fields['wall']
+        hit = np.zeros(times.shape, dtype=bool)
+        hit[entered] = walls[cells_y[entered], cells_x[entered]]
+        first = hit.argmax(axis=1)
+        found = hit[np.arange(rays), first]
+        distance = np.where(found,
+                            times[np.arange(rays), first] * np.hypot(dx, dy),
+                            limits)
+
+        inside = (cx >= 0) & (cx < width) & (cy >= 0) & (cy < height)
+        distance[~inside] = limits[~inside]
+        start = np.zeros(rays, dtype=bool)
+        start[inside] = walls[cy[inside], cx[inside]]
+        distance[start] = 0.0
+        return distance.reshape(shape)
+
+    def _cast_radar_ray(self, x, y, dir, max_distance):
+        dir1 = int(dir)
+        dir2 = (dir1+1) % self.directions
+        offsets = self.offsets[int(math.floor(y + 0.5)) % 2]
+        dx1, dy1 = offsets[dir1]
+        dx2, dy2 = offsets[dir2]
+        scale = dir % 1
+        dx = dx2*scale + dx1*(1 - scale)
+        dy = dy2*scale + dy1*(1 - scale)
+        t, obstacle = self.cast_ray(x, y, dx, dy, max_distance)
+        if obstacle is None:
+            return max_distance
+        return t * math.sqrt(dx*dx + dy*dy)
+
+    def get_wall_pyramid(self):
+        '''Return the WallPyramid of the wall field.
+
+        It is built on first use and kept current as Cells set ``wall``.
+        '''
+        if self._pyramid is None:
+            self._pyramid = WallPyramid(self.fields['wall'])
+        return self._pyramid
+
+    def any_wall(self, x0, y0, x1, y1):
+        '''Return whether any cell from (x0, y0) to (x1, y1) is a wall.'''
+        return self.get_wall_pyramid().any(self.fields['wall'],
+                                           x0, y0, x1, y1)
+
+    def get_wall_distances(self):
+        '''Return the number of steps from each cell to the nearest wall.
+
+        The result has shape (cells, directions) and counts steps through
+        `neighbour_table`, so ``[i, dir] == 1`` means the neighbour in
+        direction dir is a wall.  Where there is no wall in that
+        direction before the edge of the map the value is
+        ``width + height``, since continuous movement does not wrap around
+        the edges.  The table is built with pointer doubling the first
+        time it is needed after the walls change.  Worlds whose
+        `map_tables` is false, such as packed ones, raise a
+        CellularException instead.
+        '''
+        if not self.map_tables:
+            raise CellularException('this World has no wall distance table')
+        distances = self._wall_cache.get('distances')
+        if distances is None:
+            n = self.width * self.height
+            limit = self.width + self.height
+            table = self.neighbour_table
+            dirs = np.arange(self.directions)
+            walls = self.fields['wall'].reshape(-1)
+            ys, xs = np.divmod(np.arange(n), self.width)
+            wraps = ((np.abs(table % self.width - xs[:, None]) > 1) |
+                     (np.abs(table // self.width - ys[:, None]) > 1))
+            # distances to the first wall within `span` steps and the cell
+            # `span` steps away, with an extra cell n that steps leaving
+            # the map go to and never reach a wall from
+            distances = np.full((n + 1, self.directions), limit, dtype=np.int32)
+            distances[:n][walls[table]] = 1
+            distances[:n][wraps] = limit
+            jump = np.full((n + 1, self.directions), n, dtype=table.dtype)
+            jump[:n] = np.where(wraps, n, table)
+            span = 1
+            while span < limit:
+                further = np.minimum(span + distances[jump, dirs], limit)
+                distances = np.where(distances < limit, distances, further)
+                jump = jump[jump, dirs]
+                span *= 2
+            distances = distances[:n]
+            self._wall_cache['distances'] = distances
+        return distances
+
+    def get_distance_field(self, target, until=None):
+        '''Return the number of steps from every cell to `target`.
+
+        `target` is a Cell or a row-major index.  The result is a flat
+        int32 array, indexed like ``neighbour_table``, holding -1 for the
+        cells that cannot reach the target.  It comes from a breadth first
+        search out from the target, and the most recently used
+        `distance_fields` of them are kept until a wall changes.
+
+        If `until` is given (row-major indices), the search stops as soon
+        as it has reached all of those cells, so cells further away may be
+        left at -1; these partial fields are not kept.  Worlds whose
+        `map_tables` is false, such as packed ones, raise a
+        CellularException instead.
+        '''
+        if not self.map_tables:
+            raise CellularException('this World has no distance fields')
+        if isinstance(target, Cell):
+            target = target.y * self.width + target.x
+        fields = self._wall_cache.get('paths')
+        if fields is None:
+            fields = self._wall_cache['paths'] = collections.OrderedDict()
+        field = fields.get(target)
+        if field is not None:
+            fields.move_to_end(target)
+            return field
+        if until is not None:
+            until = np.asarray(until, dtype=np.intp)
+
+        table = self.neighbour_table
+        free = ~self.fields['wall'].reshape(-1)
+        field = np.full(self.width * self.height, -1, dtype=np.int32)
+        field[target] = 0
+        frontier = np.array([target])
+        steps = 0
+        while len(frontier):
+            steps += 1
+            cells = table[frontier].reshape(-1)
+            cells = np.unique(cells[free[cells] & (field[cells] < 0)])
+            field[cells] = steps
+            frontier = cells
+            if until is not None and (field[until] >= 0).all():
+                return field
+
+        fields[target] = field
+        while len(fields) > self.distance_fields:
+            fields.popitem(last=False)
+        return field
+
+    def find_path(self, start, goal):
+        '''Return the Cells along a shortest path from `start` to `goal`.
+
+        The path is found by A* search, so only the cells it needs are
+        looked at.  It starts with the step after `start` and ends with
+        `goal`, which may be a wall; it is None if `goal` cannot be
+        reached.
+        '''
+        width = self.width
+        height = self.height
+        table = self.neighbour_table
+        walls = self.fields['wall']
+        first = start.y * width + start.x
+        last = goal.y * width + goal.x
+        manhattan = self.directions == 4
+
+        def estimate(i):
+            y, x = divmod(i, width)
+            dx = abs(x - goal.x)
+            dy = abs(y - goal.y)
+            dx = min(dx, width - dx)
+            dy = min(dy, height - dy)
+            return dx + dy if manhattan else max(dx, dy)
+
+        cost = {first: 0}
+        previous = {}
+        queue = [(estimate(first), 0, first)]
+        while queue:
+            guess, steps, i = heapq.heappop(queue)
+            if i == last:
+                break
+            if steps > cost[i]:
+                continue
+            steps += 1
+            for dir in range(self.directions):
+                n = table.item(i, dir)
+                if n != last and walls.item(n):
+                    continue
+                if steps < cost.get(n, steps + 1):
+                    cost[n] = steps
+                    previous[n] = i
+                    heapq.heappush(queue, (steps + estimate(n), steps, n))
+        else:
+            return None
+
+        path = []
+        i = last
+        while i != first:
+            path.append(self.get_cell_at(i))
+            i = previous[i]
+        path.reverse()
+        return path
+
+    def get_step_towards(self, cell, target):
+        '''Return (dir, cell) for the first step from `cell` to `target`.
+
+        The step is on a shortest path, read from the target's distance
+        field (or found with `find_path` where there are no whole-map
+        tables).  Returns None if `cell` is `target` or there is no path.
+        '''
+        width = self.width
+        index = cell.y * width + cell.x
+        row = self.neighbour_table[index].tolist()
+        if self.map_tables:
+            field = self.get_distance_field(target)
+            here = field.item(index)
+            if here > 0:
+                for dir, n in enumerate(row):
+                    if field.item(n) == here - 1:
+                        return dir, self.get_cell_at(n)
+            return None
+        path = self.find_path(cell, target)
+        if not path:
+            return None
+        n = path[0].y * width + path[0].x
+        return row.index(n), path[0]
+
+    def snapshot(self):
+        '''Return a copy of the Cell fields, Agent poses and age of the World.
+
+        Attributes that are not fields (and so only live on the Cell
+        objects) are not included.
+        '''
+        poses = []
+        for a in self.agents:
+            cell = a.cell
+            index = None if cell is None else cell.y * self.width + cell.x
+            poses.append((a, index, getattr(a, 'x', None),
+                          getattr(a, 'y', None), getattr(a, 'dir', None)))
+        return {'fields': dict((k, v.copy()) for k, v in self.fields.items()),
+                'agents': poses,
+                'age': self.age}
+
+    def restore(self, snapshot):
+        '''Put the World back into the state returned by `snapshot`.'''
+        fields = snapshot['fields']
+        if fields.keys() != self.fields.keys():
+            raise CellularException('Snapshot is from a different kind of World')
+        changed = {}
+        kept = {}
+        for k, v in fields.items():
+            old = self.fields[k]
+            if fields_equal(old, v):
+                continue
+            if k != 'wall' and (k in self._indexes or k in self._buckets):
+                # an index or buckets of the field are brought up to date
+                # rather than built again, as a restore usually only puts
+                # back a few cells, such as the food that has been eaten
+                kept[k] = np.flatnonzero(np.asarray(old) != np.asarray(v))
+            else:
+                changed[k] = self._changed_cells(old, v)
+        for k, v in fields.items():
+            copy_field(self.fields[k], v)
+        for k, cells in changed.items():
+            self.invalidate(k, cells)
+        for k, cells in kept.items():
+            self._reindex(k, cells)
+
+        agents = [pose[0] for pose in snapshot['agents']]
+        kept = set(agents)
+        for a in self.agents:
+            if a not in kept:
+                a.world = None
+                a.cell = None
+        for a, index, x, y, dir in snapshot['agents']:
+            a.world = self
+            a.cell = None if index is None else self.get_cell_at(index)
+            a.x = x
+            a.y = y
+            a.dir = dir
+        self.agents = agents
+        self.age = snapshot['age']
+
     def remove(self, agent):
         self.agents.remove(agent)
         agent.world = None
@@ -282,7 +1879,15 @@ class World:
         self.agents.append(agent)
         if x is not None and y is not None:
             cell = self.grid[y][x]
-        if cell is None:
+        if cell is None and x is None and y is None:
+            free = self._indexes.get('free')
+            if free is None:
+                y, x = divmod(self._random_free_cell(), self.width)
+            elif len(free) == 0:
+                raise CellularException('World has no free cells')
+            else:
+                y, x = divmod(free.choice(), self.width)
+        elif cell is None:
             while True:
                 xx = x
                 yy = y
@@ -307,6 +1912,301 @@ class World:
         agent.x = x
         agent.y = y
 
+    def _random_free_cell(self):
+        # random cells are tried first, which is quick unless nearly every
+        # cell is a wall, so the free cells of a big map are not all indexed
+        walls = self.fields['wall']
+        for i in range(64):
+            index = random.randrange(self.width * self.height)
+            if not walls.item(index):
+                return index
+        free = self._find_indices('free')
+        if len(free) == 0:
+            raise CellularException('World has no free cells')
+        return int(free[random.randrange(len(free))])
+
 
 class CellularException(Exception):
     pass
+
+
+class Tile:
+    '''The field arrays of one block of cells in a TiledWorld.
+
+    (x, y) is the block's top left cell.  `changed` is set when a field is
+    written and cleared once the tile has been saved to disk.
+    '''
+
+    def __init__(self, x, y, fields):
+        self.x = x
+        self.y = y
+        self.fields = fields
+        self.changed = False
+
+
+class TiledField:
+    '''One field of a TiledWorld, indexed like a (height, width) array.
+
+    ``field[y, x]`` and ``field.item(y, x)`` address a cell by coordinates,
+    ``field[i]`` and ``field.item(i)`` by row-major index, and either form
+    of ``field[...]`` also takes index arrays.  Touching a cell loads its
+    tile.
+    '''
+
+    def __init__(self, world, name, dtype):
+        self.world = world
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.shape = (world.height, world.width)
+
+    def reshape(self, *shape):
+        # flat indexing works on the field itself
+        return self
+
+    def _coordinates(self, key):
+        if isinstance(key, tuple):
+            return key
+        return np.divmod(key, self.world.width)
+
+    def item(self, *key):
+        if len(key) == 1:
+            y, x = divmod(key[0], self.world.width)
+        else:
+            y, x = key
+        tile = self.world._get_tile(x, y)
+        return tile.fields[self.name].item(y - tile.y, x - tile.x)
+
+    def __getitem__(self, key):
+        y, x = self._coordinates(key)
+        if np.ndim(y) == 0 and np.ndim(x) == 0:
+            tile = self.world._get_tile(int(x), int(y))
+            return tile.fields[self.name][y - tile.y, x - tile.x]
+        y, x = np.broadcast_arrays(y, x)
+        values = np.empty(y.shape, dtype=self.dtype)
+        for cells, tile in self.world._group_by_tile(x, y):
+            values[cells] = tile.fields[self.name][y[cells] - tile.y,
+                                                   x[cells] - tile.x]
+        return values
+
+    def __setitem__(self, key, value):
+        y, x = self._coordinates(key)
+        if np.ndim(y) == 0 and np.ndim(x) == 0:
+            tile = self.world._get_tile(int(x), int(y))
+            tile.fields[self.name][y - tile.y, x - tile.x] = value
+            tile.changed = True
+            return
+        y, x = np.broadcast_arrays(y, x)
+        value = np.broadcast_to(value, y.shape)
+        for cells, tile in self.world._group_by_tile(x, y):
+            tile.fields[self.name][y[cells] - tile.y,
+                                   x[cells] - tile.x] = value[cells]
+            tile.changed = True
+
+
+class TiledWorld(World):
+    '''A World whose fields are stored in square tiles made on demand.
+
+    A tile of `tile_size` by `tile_size` cells is only created when an
+    Agent, a sensor or a query touches one of its cells.  It is filled in
+    by `generator(xs, ys)`, which is given the coordinate arrays of the
+    tile's cells and returns a dict of field arrays for them, or by
+    ``Cell.load`` from the matching part of `map` or `filename`.  At most
+    `max_tiles` tiles are kept in memory: the least recently used one is
+    dropped to make room, after being written to `tile_dir` (a temporary
+    directory by default) if any of its cells were changed, and is read
+    back or made again the next time it is needed.
+
+    Cells are created as they are used, as in a compact World.  Queries
+    over the whole map (``find_cells``, ``get_index``) visit every tile in
+    turn, Cells cannot have ``update`` or ``kernel`` rules, and
+    ``snapshot``, ``restore``, ``get_wall_distances``,
+    ``get_distance_field`` and ``get_wall_pyramid`` are not available;
+    paths are found with ``find_path`` instead.
+    '''
+    map_tables = False
+    pyramid_distance = None
+
+    def __init__(self, cell=None, width=None, height=None, directions=8,
+                 filename=None, map=None, generator=None, tile_size=64,
+                 max_tiles=256, tile_dir=None):
+        if cell is None:
+            cell = self.Cell
+        self.Cell = cell
+        self.directions = directions
+        self.offsets = direction_offsets[directions]
+        self.compact = True
+        self.generator = generator
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.tile_dir = tile_dir
+        self.lines = None
+        if filename or map:
+            self.lines = self._read_map(filename, map)
+            if height is None:
+                height = len(self.lines)
+            if width is None:
+                width = max([len(x) for x in self.lines])
+        if width is None:
+            width = 20
+        if height is None:
+            height = 20
+        self.width = width
+        self.height = height
+        self.image = None
+        if self.lines is not None:
+            # the map is centred in the world, as World.load does
+            map_width = max([len(x) for x in self.lines])
+            self.map_x = max(0, int((width - map_width) / 2))
+            self.map_y = max(0, int((height - len(self.lines)) / 2))
+        self.reset()
+
+    def reset(self):
+        self._view_class = get_view_class(self.Cell)
+        self._defaults = get_fields(self.Cell)
+        self.fields = dict((name, TiledField(self, name, dtype)) for
+                           name, (dtype, default) in self._defaults.items())
+        self._out = self.fields
+        self._back = None
+        self._indexes = {}
+        self._buckets = {}
+        self._watched = set(['wall'])
+        self._wall_cache = {}
+        self._pyramid = None
+        self._changes = getattr(self, '_changes', [])
+        for changes in self._changes:
+            changes.everything = True
+            self._watched.update(self.fields)
+        self._tiles = collections.OrderedDict()
+        self._tile_key = None
+        self._tile = None
+        self._stored = set()
+        self._views = weakref.WeakValueDictionary()
+        self.grid = LazyGrid(self)
+        self.neighbour_table = NeighbourTable(self)
+        self.dictBackup = None
+        self.occupancy = Occupancy(self.width, self.height)
+        self.agents = []
+        self.age = 0
+
+    def _get_tile(self, x, y):
+        '''Return the Tile holding cell (x, y), loading it if need be.'''
+        size = self.tile_size
+        key = (x // size, y // size)
+        if key == self._tile_key:
+            return self._tile
+        tile = self._tiles.get(key)
+        if tile is None:
+            tile = self._open_tile(key)
+            while len(self._tiles) > self.max_tiles:
+                self._close_tile()
+        else:
+            self._tiles.move_to_end(key)
+        self._tile_key = key
+        self._tile = tile
+        return tile
+
+    def _group_by_tile(self, x, y):
+        # yields (mask, tile) for every tile the cells (x, y) fall in
+        size = self.tile_size
+        across = -(-self.width // size)
+        keys = (y // size) * across + x // size
+        for key in np.unique(keys).tolist():
+            ty, tx = divmod(key, across)
+            yield keys == key, self._get_tile(tx * size, ty * size)
+
+    def _each_tile(self):
+        size = self.tile_size
+        for y in range(0, self.height, size):
+            for x in range(0, self.width, size):
+                yield self._get_tile(x, y)
+
+    def _tile_path(self, key):
+        if self.tile_dir is None:
+            self.tile_dir = tempfile.mkdtemp(prefix='tiles')
+        return os.path.join(self.tile_dir, '%d_%d.tile' % key)
+
+    def _open_tile(self, key):
+        size = self.tile_size
+        x = key[0] * size
+        y = key[1] * size
+        if key in self._stored:
+            with open(self._tile_path(key), 'rb') as f:
+                tile = Tile(x, y, pickle.load(f))
+            self._tiles[key] = tile
+            return tile
+
+        shape = (min(size, self.height - y), min(size, self.width - x))
+        fields = dict((name, np.full(shape, default, dtype=dtype))
+                      for name, (dtype, default) in self._defaults.items())
+        tile = Tile(x, y, fields)
+        self._tiles[key] = tile
+        if self.generator is not None:
+            ys, xs = np.mgrid[y:y + shape[0], x:x + shape[1]]
+            for name, values in self.generator(xs, ys).items():
+                fields[name][...] = values
+        elif self.lines is not None:
+            self._tile_key = key
+            self._tile = tile
+            for j in range(max(y, self.map_y),
+                           min(y + shape[0], self.map_y + len(self.lines))):
+                line = self.lines[j - self.map_y]
+                for i in range(max(x, self.map_x),
+                               min(x + shape[1], self.map_x + len(line))):
+                    self._get_view(i, j).load(line[i - self.map_x])
+        tile.changed = False
+        return tile
+
+    def _close_tile(self):
+        key, tile = self._tiles.popitem(last=False)
+        if key == self._tile_key:
+            self._tile_key = None
+            self._tile = None
+        if tile.changed:
+            with open(self._tile_path(key), 'wb') as f:
+                pickle.dump(tile.fields, f, protocol=pickle.HIGHEST_PROTOCOL)
+            self._stored.add(key)
+
+    def _find_indices(self, name):
+        found = []
+        width = self.width
+        for tile in self._each_tile():
+            if name == 'free':
+                mask = ~tile.fields['wall']
+            else:
+                mask = tile.fields[name].astype(bool)
+            y, x = np.nonzero(mask)
+            found.append((y + tile.y) * width + x + tile.x)
+        return np.concatenate(found)
+
+    def add(self, agent, x=None, y=None, cell=None, dir=None):
+        if cell is None and x is None and y is None:
+            # pick a free cell without indexing every tile
+            walls = self.fields['wall']
+            while True:
+                x = random.randrange(self.width)
+                y = random.randrange(self.height)
+                if not walls.item(y, x):
+                    break
+        World.add(self, agent, x=x, y=y, cell=cell, dir=dir)
+
+    def update(self):
+        if (getattr(self.Cell, 'kernel', None) is not None or
+                hasattr(self.Cell, 'update')):
+            raise CellularException(
+                'TiledWorld Cells cannot have update rules')
+        World.update(self)
+
+    def get_wall_distances(self):
+        raise CellularException('TiledWorld has no wall distance table')
+
+    def get_wall_pyramid(self):
+        raise CellularException('TiledWorld has no wall pyramid')
+
+    def get_distance_field(self, target, until=None):
+        raise CellularException('TiledWorld has no distance fields')
+
+    def snapshot(self):
+        raise CellularException('TiledWorld cannot be snapshotted')
+
+    def restore(self, snapshot):
+        raise CellularException('TiledWorld cannot be snapshotted')
@@ -1,76 +1,150 @@
 import math
 
+import numpy as np
+
 from pm import cellular
 
 
 class Body(cellular.Agent):
-    def go_in_direction(self, dir, distance=1, return_obstacle=False):
+    # moves longer than this along either axis are swept against the walls
+    # instead of settled by the closest cell, so they cannot jump a wall
+    max_step = 0.5
 
-        dir1 = int(dir)
-        dir2 = (dir1+1) % self.world.directions
+    def go_in_direction(self, dir, distance=1, return_obstacle=False,
+                        slide=False):
+        '''Move `distance` along direction `dir`, unless a wall is in the way.
 
-        dx1, dy1 = self.world.get_offset_in_direction(self.cell.x, self.cell.y, dir1)
-        dx2, dy2 = self.world.get_offset_in_direction(self.cell.x, self.cell.y, dir2)
+        A short move ends in whichever of the body's cell and its
+        neighbours is closest to where it is going, and does not happen
+        at all if that is a wall.  A move of more than `max_step` along
+        either axis is checked against every cell it passes through and
+        stops just short of the first wall.  With `slide`, what is left of
+        a move a wall stops is made along x and then along y, each as far
+        as it goes, so the body slides along the wall.  Returns False (or the wall Cell,
+        if `return_obstacle` is set) when a wall got in the way.
+        '''
+        dx, dy = self.get_direction_vector(dir)
+        x = self.x + distance*dx
+        y = self.y + distance*dy
+        obstacle = self._move_by(distance*dx, distance*dy)
+        if obstacle is not None and slide:
+            # what is left of the move, along x and then along y
+            for rest_x, rest_y in ((x - self.x, 0), (0, y - self.y)):
+                if rest_x or rest_y:
+                    self._move_by(rest_x, rest_y)
 
-        scale = dir % 1
+        if return_obstacle:
+            return obstacle
+        else:
+            return obstacle is None
+
+    def _move_by(self, dx, dy):
+        # moves the body by (dx, dy) and returns the wall that stopped it
+        world = self.world
+        if max(abs(dx), abs(dy)) > self.max_step:
+            return self._sweep(dx, dy)
 
-        x = self.x + distance*(dx2*scale + dx1*(1 - scale))
-        y = self.y + distance*(dy2*scale + dy1*(1 - scale))
+        cell = self.cell
+        width = world.width
+        x = self.x + dx
+        y = self.y + dy
 
-        closest = self.cell
-        dist = (x-self.cell.x)**2 + (y-self.cell.y)**2
-        for n in self.cell.neighbour:
-            d = (x-n.x)**2 + (y-n.y)**2
+        index = cell.y * width + cell.x
+        closest = index
+        dist = (x-cell.x)**2 + (y-cell.y)**2
+        for n in world.neighbour_table[index].tolist():
+            d = (x-n % width)**2 + (y-n // width)**2
             if d < dist:
                 closest = n
                 dist = d
-        if closest is not self.cell:
-            if closest.wall:
-                if return_obstacle:
-                    return closest
-                else:
-                    return False
+        if closest != index:
+            if world.fields['wall'].item(closest):
+                return world.get_cell_at(closest)
             else:
-                self.cell = closest
+                self.cell = world.get_cell_at(closest)
 
         self.x = x
         self.y = y
+        return None
 
-        if return_obstacle:
-            return None
-        else:
-            return True
+    def _sweep(self, dx, dy):
+        world = self.world
+        t, obstacle = world.cast_ray(self.x, self.y, dx, dy, 1.0)
+        if obstacle is None:
+            # cast_ray does not count a wall entered exactly at the end of
+            # the move, but the body would end up inside it
+            end = world.get_cell(
+                int(math.floor(self.x + dx + 0.5)) % world.width,
+                int(math.floor(self.y + dy + 0.5)) % world.height)
+            if end.wall:
+                t, obstacle = 1.0, end
+        if obstacle is not None:
+            if t == 0:
+                return obstacle
+            # stop just inside the last cell before the wall
+            t = max(t - 1e-9 / max(abs(dx), abs(dy)), 0.0)
+        x = self.x + t*dx
+        y = self.y + t*dy
+        cx = int(math.floor(x + 0.5)) % world.width
+        cy = int(math.floor(y + 0.5)) % world.height
+        if cx != self.cell.x or cy != self.cell.y:
+            self.cell = world.get_cell(cx, cy)
+        self.x = x
+        self.y = y
+        return obstacle
+
+    def go_forward(self, distance=1, slide=False):
+        return self.go_in_direction(self.dir, distance=distance, slide=slide)
 
-    def go_forward(self, distance=1):
-        return self.go_in_direction(self.dir, distance=distance)
+    def go_backward(self, distance=1, slide=False):
+        return self.go_in_direction(self.dir, distance=-distance, slide=slide)
 
-    def go_backward(self, distance=1):
-        return self.go_in_direction(self.dir, distance=-distance)
+    def get_direction_vector(self, dir):
+        dir1 = int(dir)
+        dir2 = (dir1+1) % self.world.directions
+
+        offsets = self.world.offsets[self.cell.y % 2]
+        dx1, dy1 = offsets[dir1]
+        dx2, dy2 = offsets[dir2]
+
+        scale = dir % 1
+        return dx2*scale + dx1*(1 - scale), dy2*scale + dy1*(1 - scale)
 
     def detect(self, direction, max_distance=None):
-        start_x = self.x
-        start_y = self.y
+        '''Return (distance, obstacle) for the nearest wall in `direction`.
+
+        The distance is exact; if there is no wall within `max_distance`
+        the result is ``(max_distance, None)``.  The agent is not moved.
+        '''
+        world = self.world
         cell = self.cell
-        distance = 0.0
-        delta = 1.0
-        min_delta = 1.0 / 64
-        obstacle = None
         if max_distance is None:
-            max_distance = self.world.width + self.world.height
-
-        while distance < max_distance:
-            obstacle = self.go_in_direction(direction, delta, return_obstacle=True)
-            if obstacle is None:
-                distance += delta
-            elif delta > min_delta:
-                delta = delta / 2
-            else:
-                distance = math.sqrt((start_x-self.x)**2 + (start_y-self.y)**2)
-                break
-        self.cell = cell
-        self.x = start_x
-        self.y = start_y
-        return distance, obstacle
+            max_distance = world.width + world.height
+
+        if (direction % 1 == 0 and self.x == cell.x and self.y == cell.y
+                and world.directions in (4, 8) and world.map_tables):
+            return self.detect_from_centre(int(direction), max_distance)
+
+        dx, dy = self.get_direction_vector(direction)
+        t, obstacle = world.cast_ray(self.x, self.y, dx, dy, max_distance)
+        if obstacle is None:
+            return max_distance, None
+        return t * math.sqrt(dx*dx + dy*dy), obstacle
+
+    def detect_from_centre(self, direction, max_distance):
+        # a ray from a cell centre along a whole direction enters the
+        # first wall, k steps away in the world's wall distance table,
+        # after k - 0.5 steps
+        world = self.world
+        cell = self.cell
+        index = cell.y * world.width + cell.x
+        steps = world.get_wall_distances().item(index, direction)
+        hit = steps - 0.5
+        if steps >= world.width + world.height or hit >= max_distance:
+            return max_distance, None
+        dx, dy = world.offsets[0][direction]
+        obstacle = world.get_cell(cell.x + steps * dx, cell.y + steps * dy)
+        return hit * math.sqrt(dx * dx + dy * dy), obstacle
 
     def get_direction_to(self, cell):
         dx = cell.x - self.x
@@ -85,3 +159,143 @@ class Body(cellular.Agent):
         dy = cell.y - self.y
         return math.sqrt(dx**2 + dy**2)
 
+
+class Kinematics:
+    '''Turns and moves a group of Bodies together.
+
+    The poses of `bodies` are held in the arrays `x`, `y`, `dir` and
+    `speed`, and step() applies a turn and a forward move to every body at
+    once, stopping at walls by the same rule as go_in_direction.  Moves
+    longer than a body's `max_step`, which have to be swept, and blocked
+    moves that `slide` are made one body at a time.  Each step
+    writes the new poses back to the bodies, but step() does not read them
+    again: after moving a body any other way (setting its pose or cell,
+    go_forward, World.restore) call pull() before the next step.
+    '''
+    # fewer bodies than this are moved one at a time, which is faster than
+    # setting up the arrays
+    batch = 16
+
+    def __init__(self, world, bodies, speed=1.0):
+        self.world = world
+        self.bodies = list(bodies)
+        self.speed = np.array(np.broadcast_to(
+            np.asarray(speed, dtype=float), (len(self.bodies),)))
+        self.max_step = np.array([body.max_step for body in self.bodies])
+        self.offsets = np.array([world.offsets[0], world.offsets[1]],
+                                dtype=float)
+        self.pull()
+
+    def pull(self, which=None):
+        '''Read the poses of the bodies in `which` (default all) again.'''
+        width = self.world.width
+        if which is not None:
+            for i in which:
+                body = self.bodies[i]
+                self.x[i] = body.x
+                self.y[i] = body.y
+                self.dir[i] = body.dir
+                self.index[i] = body.cell.y * width + body.cell.x
+            return
+        bodies = self.bodies
+        self.x = np.array([body.x for body in bodies], dtype=float)
+        self.y = np.array([body.y for body in bodies], dtype=float)
+        self.dir = np.array([body.dir for body in bodies], dtype=float)
+        self.index = np.array([body.cell.y * width + body.cell.x
+                               for body in bodies], dtype=np.intp)
+
+    def push(self, which=None):
+        '''Write the poses of the bodies in `which` (default all) back.'''
+        world = self.world
+        width = world.width
+        if which is None:
+            which = range(len(self.bodies))
+        for i in which:
+            body = self.bodies[i]
+            body.x = self.x.item(i)
+            body.y = self.y.item(i)
+            body.dir = self.dir.item(i)
+            index = self.index.item(i)
+            cell = body.cell
+            if cell.y * width + cell.x != index:
+                body.cell = world.get_cell_at(index)
+
+    def step(self, turn, forward, which=None, slide=False):
+        '''Turn each body by `turn` and then move it forwards.
+
+        Each body moves `forward` times its `speed`; `turn` and `forward`
+        are scalars or arrays with one value per body moved.  `which`
+        selects the bodies to move (an index array or boolean mask), by
+        default all of them, and `slide` is passed on to go_in_direction.
+        Returns a boolean array that is False for the bodies a wall
+        stopped.
+        '''
+        which = np.arange(len(self.bodies))[slice(None) if which is None
+                                            else which]
+        if len(which) < self.batch:
+            return self._step_each(turn, forward, which, slide)
+
+        world = self.world
+        width = world.width
+        directions = world.directions
+
+        dir = (self.dir[which] + turn) % directions
+        index = self.index[which]
+        x = self.x[which]
+        y = self.y[which]
+
+        # the same blend of whole directions as get_direction_vector
+        dir1 = dir.astype(np.intp) % directions
+        dir2 = (dir1 + 1) % directions
+        scale = (dir % 1)[:, None]
+        parity = (index // width) % 2
+        vector = (self.offsets[parity, dir2]*scale +
+                  self.offsets[parity, dir1]*(1 - scale))
+        forward = np.zeros(len(which)) + forward
+        distance = forward * self.speed[which]
+        new_x = x + distance*vector[:, 0]
+        new_y = y + distance*vector[:, 1]
+
+        # each body ends up in whichever of its cell and that cell's
+        # neighbours is closest, unless that is a wall
+        cells = np.concatenate(
+            (index[:, None], world.neighbour_table[index]), axis=1)
+        cells_y, cells_x = np.divmod(cells, width)
+        closest = cells[np.arange(len(which)), np.argmin(
+            (new_x[:, None] - cells_x)**2 + (new_y[:, None] - cells_y)**2,
+            axis=1)]
+        # (packed and tiled wall fields take row-major indices too)
+        moved = ~((closest != index) &
+                  world.fields['wall'].reshape(-1)[closest])
+
+        # long moves and blocked ones that slide are left to the bodies
+        alone = (np.abs(distance[:, None]*vector) >
+                 self.max_step[which, None]).any(axis=1)
+        if slide:
+            alone |= ~moved
+        keep = moved & ~alone
+
+        self.dir[which] = dir
+        self.x[which] = np.where(keep, new_x, x)
+        self.y[which] = np.where(keep, new_y, y)
+        self.index[which] = np.where(keep, closest, index)
+        self.push(which.tolist())
+        if alone.any():
+            moved[alone] = self._step_each(0.0, forward[alone], which[alone],
+                                           slide)
+        return moved
+
+    def _step_each(self, turn, forward, which, slide=False):
+        turn = (np.zeros(len(which)) + turn).tolist()
+        distance = (forward * self.speed[which]).tolist()
+        width = self.world.width
+        moved = []
+        for i, amount, d in zip(which.tolist(), turn, distance):
+            body = self.bodies[i]
+            body.turn(amount)
+            moved.append(body.go_forward(d, slide=slide))
+            self.x[i] = body.x
+            self.y[i] = body.y
+            self.dir[i] = body.dir
+            self.index[i] = body.cell.y * width + body.cell.x
+        return np.array(moved, dtype=bool)
@@ -0,0 +1,343 @@
+import collections
+import itertools
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+
+
+def merge_rectangles(mask):
+    '''Cover the True cells of a 2D mask with few rectangles.
+
+    Runs of cells along a row are merged downwards for as long as the same
+    run carries on in the next row.  Returns a list of (x, y, width,
+    height), ordered by y and then x.
+    '''
+    mask = np.asarray(mask, dtype=bool)
+    height, width = mask.shape
+    padded = np.zeros(width + 2, dtype=np.int8)
+    rects = []
+    runs = {}
+    for y in range(height + 1):
+        row = set()
+        if y < height:
+            padded[1:-1] = mask[y]
+            edges = np.diff(padded)
+            row = set(zip(np.flatnonzero(edges == 1).tolist(),
+                          np.flatnonzero(edges == -1).tolist()))
+        for run in [run for run in runs if run not in row]:
+            x0, x1 = run
+            y0 = runs.pop(run)
+            rects.append((x0, y0, x1 - x0, y - y0))
+        for run in row:
+            runs.setdefault(run, y)
+    rects.sort(key=lambda rect: (rect[1], rect[0]))
+    return rects
+
+
+def svg_number(value, digits=2):
+    '''Format `value` for SVG, rounded to `digits` decimals.'''
+    text = '%.*f' % (digits, value)
+    if '.' in text:
+        text = text.rstrip('0').rstrip('.')
+    return '0' if text == '-0' else text
+
+
+class CellFrame:
+    '''The fields of the Cells of a World, copied to be drawn later.
+
+    Cells from `get_cell_at` read the copies, so they can be drawn on
+    another thread while the World carries on changing.  With `indices`
+    only those Cells are copied, which is much cheaper than copying every
+    field.
+    '''
+
+    def __init__(self, world, indices=None):
+        self.width = world.width
+        self.height = world.height
+        self._view_class = world._view_class
+        if indices is None:
+            self.fields = dict((name, array.copy())
+                               for name, array in world.fields.items())
+        else:
+            ys, xs = np.divmod(np.asarray(indices, dtype=np.intp),
+                               self.width)
+            self.fields = dict(
+                (name, _PickedCells(self.width, indices,
+                                    np.asarray(array[ys, xs]).tolist()))
+                for name, array in world.fields.items())
+
+    def get_cell_at(self, index):
+        y, x = divmod(index, self.width)
+        c = self._view_class.__new__(self._view_class)
+        c.x = x
+        c.y = y
+        c.world = self
+        return c
+
+
+class _PickedCells:
+    # the values of one field in some of the cells, read like the array
+    def __init__(self, width, indices, values):
+        self.width = width
+        self.values = dict(zip(indices, values))
+
+    def item(self, y, x):
+        return self.values[y * self.width + x]
+
+
+class SvgLayers:
+    '''SVG markup for a World, redrawn only where it changes.
+
+    `draw_cell(cell)` returns the markup for one Cell, or '' for none, and
+    `draw_agent(key)` the markup for an Agent from its `agent_key(agent)`,
+    which should hold everything the markup depends on.  Walls are joined
+    into a static layer that is only rebuilt when a wall changes; the
+    markup of other Cells is kept per Cell and redrawn only for the Cells
+    that changed since the last frame, and an Agent is only redrawn when
+    its key changes.
+
+    A frame is drawn in two halves: `capture` copies what changed and
+    `render` turns the copy into markup, and can run on another thread
+    while the World carries on.  `update` does both.
+
+    With `merge_walls`, wall Cells are not drawn one by one: the static
+    layer is one path per wall `color`, made of as few rectangles as
+    possible.  Markup that is used over and over can be declared once with
+    `sprite` and then referred to by its id.
+
+    The layers collect the World's changes until `close` is called or
+    they are dropped.
+    '''
+    _ids = itertools.count()
+
+    def __init__(self, world, draw_cell, draw_agent, agent_key,
+                 merge_walls=False):
+        self.world = world
+        self.draw_cell = draw_cell
+        self.draw_agent = draw_agent
+        self.agent_key = agent_key
+        self.merge_walls = merge_walls
+        self.changes = world.track_changes()
+        self.frame = None
+        self.wall_cells = {}
+        self.other_cells = {}
+        self.walls = ''
+        self.cells = ''
+        self.agents = {}
+        self.prefix = 's%d-' % next(SvgLayers._ids)
+        self.sprites = {}
+        self.defs = ''
+
+    def close(self):
+        '''Stop collecting the World's changes; capture cannot be used then.'''
+        changes = getattr(self, 'changes', None)
+        if changes is not None:
+            self.world.untrack_changes(changes)
+            self.changes = None
+
+    def __del__(self):
+        self.close()
+
+    def sprite(self, key, markup):
+        '''Return the id of the sprite `key`, declaring it if it is new.
+
+        `markup` is the sprite's element with ``%s`` where its id goes;
+        the declarations are kept in `defs`.
+        '''
+        sprite = self.sprites.get(key)
+        if sprite is None:
+            sprite = self.prefix + str(len(self.sprites))
+            self.sprites[key] = sprite
+            self.defs += markup % sprite
+        return sprite
+
+    def update(self):
+        '''Return the (walls, cells, agents) markup for the current frame.'''
+        return self.render(self.capture())
+
+    def capture(self):
+        '''Copy what changed in the World since the last capture.
+
+        Only the changed Cells and the Agents' keys are copied, unless a
+        wall Cell changed, when the merged wall layer needs every Cell.
+        '''
+        world = self.world
+        walls = 'wall' in self.changes.fields
+        changed = self.changes.take()
+        if self.merge_walls and changed and not walls:
+            # other fields of a wall Cell can change its colour, which
+            # redraws the merged walls too
+            field = world.fields['wall']
+            walls = any(field.item(i) for i in changed)
+        if changed is None or (walls and self.merge_walls):
+            frame = CellFrame(world)
+        else:
+            frame = CellFrame(world, sorted(changed))
+        agents = [(agent, self.agent_key(agent)) for agent in world.agents]
+        return changed, frame, agents
+
+    def render(self, captured):
+        '''Return the (walls, cells, agents) markup for a `capture`.'''
+        changed, frame, agents = captured
+        self.frame = frame
+        if changed is None:
+            self.wall_cells = {}
+            self.other_cells = {}
+            for i in range(frame.width * frame.height):
+                self._draw(frame.get_cell_at(i), i)
+            self._join_walls()
+            self.cells = ''.join(self.other_cells.values())
+        elif changed:
+            walls = False
+            for i in sorted(changed):
+                if self.wall_cells.pop(i, None) is not None:
+                    walls = True
+                self.other_cells.pop(i, None)
+                walls = self._draw(frame.get_cell_at(i), i) or walls
+            if walls:
+                self._join_walls()
+            self.cells = ''.join(self.other_cells.values())
+
+        drawn = {}
+        for agent, key in agents:
+            old = self.agents.get(agent)
+            if old is None or old[0] != key:
+                old = key, self.draw_agent(key)
+            drawn[agent] = old
+        self.agents = drawn
+        return (self.walls, self.cells,
+                ''.join(markup for key, markup in drawn.values()))
+
+    def _draw(self, cell, index):
+        # files the markup of one Cell and returns whether it is a wall
+        wall = bool(getattr(cell, 'wall', False))
+        if wall:
+            self.wall_cells[index] = ('' if self.merge_walls
+                                      else self.draw_cell(cell))
+        else:
+            markup = self.draw_cell(cell)
+            if markup:
+                self.other_cells[index] = markup
+        return wall
+
+    def _join_walls(self):
+        if not self.merge_walls:
+            self.walls = ''.join(self.wall_cells.values())
+            return
+        frame = self.frame
+        colors = collections.OrderedDict()
+        for i in sorted(self.wall_cells):
+            color = frame.get_cell_at(i).color
+            if callable(color):
+                color = color()
+            if color is not None:
+                colors.setdefault(color, []).append(i)
+        paths = []
+        for color, indices in colors.items():
+            mask = np.zeros(frame.width * frame.height, dtype=bool)
+            mask[indices] = True
+            rects = merge_rectangles(mask.reshape(frame.height, frame.width))
+            paths.append('<path d="%s" style="fill:%s"/>' % (''.join(
+                'M%d %dh%dv%dh-%dz' % (x, y, w, h, w)
+                for x, y, w, h in rects), color))
+        self.walls = ''.join(paths)
+
+
+# what FrameWorker.stop puts on the queue to end the thread
+_stop = object()
+
+
+class FrameWorker:
+    '''Paces the frames of a display and can render them on a thread.
+
+    `ready` says whether to start a frame now: not while the last one is
+    still being rendered, nor sooner than 1/`max_fps` seconds of wall-clock
+    time after it started.  `submit(frame)` then passes `render(frame)` to
+    `done`, on a daemon thread if `threaded` is set and straight away
+    otherwise.  An exception in the thread is raised again by the next
+    `ready`.
+
+    `stop` ends the thread once it has drawn what it was given, and the
+    thread also ends by itself after `idle` seconds without a frame, as
+    when the simulation has been closed; `submit` starts a new one.
+    '''
+
+    def __init__(self, render, done, max_fps=None, threaded=False, idle=5.0):
+        self.render = render
+        self.done = done
+        self.interval = 1.0 / max_fps if max_fps else 0.0
+        self.threaded = threaded
+        self.idle = idle
+        self.busy = False
+        self.last = None
+        self.error = None
+        self.frames = None
+        self.thread = None
+        self.lock = threading.Lock()
+
+    def ready(self):
+        if self.error is not None:
+            error, self.error = self.error, None
+            raise error
+        return not self.busy and (self.last is None or
+                                  time.time() >= self.last + self.interval)
+
+    def submit(self, frame):
+        self.last = time.time()
+        if not self.threaded:
+            self.done(self.render(frame))
+            return
+        self.busy = True
+        with self.lock:
+            if self.thread is None:
+                # every thread has a queue of its own, so one that is
+                # stopping never takes the frames of the next
+                self.frames = queue.Queue()
+                self.thread = threading.Thread(target=self._run,
+                                               args=(self.frames,))
+                self.thread.daemon = True
+                self.thread.start()
+            self.frames.put(frame)
+
+    def stop(self):
+        '''End the thread, waiting for it to draw what it was given.'''
+        with self.lock:
+            thread, self.thread = self.thread, None
+            if thread is not None:
+                self.frames.put(_stop)
+        if thread is not None and thread is not threading.current_thread():
+            thread.join()
+
+    def _run(self, frames):
+        while True:
+            try:
+                frame = frames.get(timeout=self.idle)
+            except queue.Empty:
+                with self.lock:
+                    if frames.empty():
+                        if self.frames is frames:
+                            self.thread = None
+                        return
+                continue
+            if frame is _stop:
+                return
+            try:
+                self.done(self.render(frame))
+            except Exception as e:
+                self.error = e
+            self.busy = False
+
+
+def running_headless(headless=None):
+    '''Return whether to leave displays out of a model.
+
+    `headless` is used if it is given; otherwise the NENGO_HEADLESS
+    environment variable decides, so batch runs can turn the displays off
+    without changing any code.
+    '''
+    if headless is None:
+        headless = os.environ.get('NENGO_HEADLESS', '') not in ('', '0')
+    return bool(headless)
@@ -1,5 +1,7 @@
 import numpy as np
 
+from pm import cellular
+
 
 def pick_one(rng, options):
     item = rng.randint(len(options))
@@ -16,18 +18,13 @@ def pick_few(rng, options, count):
     return options[items]
 
 
-def generateMaze(num_rows, num_cols, num_ghosts=3, seed=None, num_passage=2,
-                 empty=False):
-
-    rng = np.random.RandomState(seed=seed)
+def carve_maze(rng, num_rows, num_cols, num_passage=2, empty=False):
 
     M = np.zeros((num_rows, num_cols, 5), dtype=np.uint8)
     # The array M is going to hold the array information for each cell.
     # The first four coordinates tell if walls exist on those sides
     # and the fifth indicates if the cell has been visited in the search.
     # M(LEFT, UP, RIGHT, DOWN, CHECK_IF_VISITED)
-    image = np.zeros((num_rows*10, num_cols*10), dtype=np.uint8)
-    # The array image is going to be the output image to display
 
     # Set starting row and column
     r = 0
@@ -55,7 +52,7 @@ def generateMaze(num_rows, num_cols, num_ghosts=3, seed=None, num_passage=2,
 
         if len(check): # If there is a valid cell to move to.
             # Mark the walls between cells as open if we move
-            history.append([r, c])
+            history.append((r, c))
             move_direction = pick_one(rng, check)
             if move_direction == 'L':
                 M[r, c, 0] = 1
@@ -99,22 +96,35 @@ def generateMaze(num_rows, num_cols, num_ghosts=3, seed=None, num_passage=2,
             #elif walls[2][i] == 3:
             #    M[walls[0][i]+1, walls[1][i], 1] = 1
 
+    return M
+
+
+def open_rows(M, row):
+    # The 10 rows of image pixels for maze row `row`, with True where the
+    # pixel is open: the inside of each cell plus the sides without walls
+    cells = M[row, :, :4, None] == 1
+    block = np.zeros((M.shape[1], 10, 10), dtype=bool)
+    block[:, 1:9, 1:9] = True
+    block[:, 1:9, 0] = cells[:, 0]
+    block[:, 0, 1:9] = cells[:, 1]
+    block[:, 1:9, 9] = cells[:, 2]
+    block[:, 9, 1:9] = cells[:, 3]
+    return block.transpose(1, 0, 2).reshape(10, M.shape[1] * 10)
+
+
+def generateMaze(num_rows, num_cols, num_ghosts=3, seed=None, num_passage=2,
+                 empty=False):
+
+    rng = np.random.RandomState(seed=seed)
+
+    M = carve_maze(rng, num_rows, num_cols, num_passage, empty)
+    image = np.zeros((num_rows*10, num_cols*10), dtype=np.uint8)
+    # The array image is going to be the output image to display
+
     if not empty:
         # Generate the image for display
         for row in range(0, num_rows):
-            for col in range(0, num_cols):
-
-                cell_data = M[row, col]
-                for i in range(10*row+1, 10*row+9):
-                    image[i, range(10*col+1, 10*col+9)] = 255
-                    if cell_data[0] == 1:
-                        image[range(10*row+1, 10*row+9), 10*col] = 255
-                    if cell_data[1] == 1:
-                        image[10*row, range(10*col+1, 10*col+9)] = 255
-                    if cell_data[2] == 1:
-                        image[range(10*row+1, 10*row+9), 10*col+9] = 255
-                    if cell_data[3] == 1:
-                        image[10*row+9, range(10*col+1, 10*col+9)] = 255
+            image[10*row:10*row+10][open_rows(M, row)] = 255
     else:
         image[1:-1, 1:-1] = 255
 
@@ -140,5 +150,28 @@ def generateMaze(num_rows, num_cols, num_ghosts=3, seed=None, num_passage=2,
     return new
 
 
+def generateWalls(num_rows, num_cols, seed=None, num_passage=2, empty=False):
+    '''Return the walls of a maze as a cellular.BitField.
+
+    This is the maze generateMaze makes from the same arguments, without
+    the ghosts, but each row of the image is packed into bits as soon as
+    it is drawn, so the whole maze never takes more than a bit per cell.
+    '''
+    rng = np.random.RandomState(seed=seed)
+
+    M = carve_maze(rng, num_rows, num_cols, num_passage, empty)
+    walls = cellular.BitField(num_rows*10, num_cols*10, fill=True)
+
+    if not empty:
+        for row in range(0, num_rows):
+            walls.bits[10*row:10*row+10] = np.packbits(~open_rows(M, row),
+                                                       axis=1)
+    else:
+        line = np.ones(num_cols*10, dtype=bool)
+        line[1:-1] = False
+        walls.bits[1:-1] = np.packbits(line)
+    return walls
+
+
 if __name__ == '__main__':
     print(generateMaze(4, 4, num_ghosts=3, seed=None))
@@ -5,6 +5,7 @@ import nengo
 from pm import cellular
 from pm import continuous
 from pm import body
+from pm import display
 from threading import Timer
 
 # Global variables that contain information about the pacman and ghost
@@ -19,12 +20,28 @@ from threading import Timer
 
 # The cell class encapsulates every "object" in the game (walls, food, enemies, pacman, etc.)
 class Cell(cellular.Cell):
+    # Every attribute is a field, so Cells need no __dict__
+    __slots__ = ()
 
     # These are the inital states of the food, pacman start and enemy start booleans
     food = False
     pacman_start = False
     enemy_start = False
-    state = None
+    space = False
+    food_start = False
+
+    # A cell's state is 'food' if it was loaded with food, and stays so once
+    # the food is eaten.  It is kept as the food_start flag so that packed
+    # worlds store a bit rather than an object for every cell
+    @property
+    def state(self):
+        return 'food' if self.food_start else None
+
+    @state.setter
+    def state(self, value):
+        if value not in ('food', None):
+            raise ValueError("a cell's state must be 'food' or None")
+        self.food_start = value == 'food'
 
     # The Color function sets the color of both the wall and food
     def color(self):
@@ -52,7 +69,14 @@ class Cell(cellular.Cell):
 
 # GridNode sets up the pacman world for visualization
 class GridNode(nengo.Node):
-    def __init__(self, world, dt=0.001):
+    def __init__(self, world, dt=0.001, compact=False, max_fps=None,
+                 threaded=False):
+        # the markup of the world, kept between refreshes so that only what
+        # changed is redrawn
+        self.layers = None
+        # compact SVG merges the walls into paths, declares each agent
+        # image once and rounds coordinates
+        self.compact = compact
 
         # The initalizer sets up the html layout for display
         def svg(t):
@@ -60,65 +84,118 @@ class GridNode(nengo.Node):
             if last_t is not None and t <= last_t:
                 last_t = None
             if last_t is None or t >= last_t + dt:
-                svg._nengo_html_ = self.generate_svg(world)
-                svg._nengo_html_t_ = t
+                if self.worker.ready():
+                    self.worker.submit(self.capture(world))
+                    svg._nengo_html_t_ = t
+
+        # Frames are drawn at most max_fps times a (wall-clock) second, and
+        # with threaded, on a thread of their own so the simulation does
+        # not wait for them; _nengo_html_ holds the latest finished frame
+        def done(html):
+            svg._nengo_html_ = html
+        self.worker = display.FrameWorker(self.render, done, max_fps=max_fps,
+                                          threaded=threaded)
         super(GridNode, self).__init__(svg)
 
     # This function sets up an SVG (used to embed html code in the environment)
     def generate_svg(self, world):
-        cells = []
-        # Runs through every cell in the world (walls & food)
-        listFood = list()
-        for i in range(world.width):
-            for j in range(world.height):
-                cell = world.get_cell(i, j)
-                color = cell.color
-                if callable(color):
-                    color = color()
-
-                # If the cell is a wall, then set its appearance to a blue rectangle
-                if cell.wall:
-                    cells.append('<rect x=%d y=%d width=1 height=1 style="fill:%s"/>' %
-                         (i, j, color))
-
-                # If the cell is normal food, then set its appearance to a white circle
-                if cell.food:
-                    cells.append('<circle cx=%d cy=%d r=0.4 style="fill:%s"/>' %
-                        (i, j, color))
-
-        # Runs through every agent in the world (ghost & pacman)
-        agents = []
-        for agent in world.agents:
-
-            # sets variables like agent direction, color and size
-            direction = agent.dir * 360.0 / world.directions
-            color = getattr(agent, 'color', 'yellow')
-            if callable(color):
-                color = color()
-            s = agent.size * 2
-
-            # Uses HTML rendering to setup the agents
-            agent_poly = ('<image xlink:href="local/%s.png" x="%f" y="%f" '
-                    ' width="%f" height="%f" transform="translate(%f,%f) rotate(%f)"/>'
-                         % (agent.typeBody, -s/2, -s/2, s, s, agent.x+0.5, agent.y+0.5, direction - 90))
-
-            agents.append(agent_poly)
+        return self.render(self.capture(world))
+
+    # Stops the frame thread and collecting the world's changes to draw (nengo
+    # keeps a Node's output function alive, and the node with it, so dropping
+    # the node is not enough)
+    def close(self):
+        self.worker.stop()
+        if self.layers is not None:
+            self.layers.close()
+            self.layers = None
+
+    # Copies what changed in the world, to be rendered later
+    def capture(self, world):
+        if self.layers is None or self.layers.world is not world:
+            if self.layers is not None:
+                self.layers.close()
+            self.layers = display.SvgLayers(world, self.draw_cell,
+                                            self.draw_agent, self.agent_key,
+                                            merge_walls=self.compact)
+        return self.layers, self.layers.capture()
+
+    def render(self, frame):
+        layers, captured = frame
+        world = layers.world
+        walls, cells, agents = layers.render(captured)
+        if self.compact:
+            walls = '<defs>%s</defs>%s' % (layers.defs, walls)
 
         # Sets up the environment as a HTML SVG
         svg = '''<svg style="background: black" width="100%%" height="100%%" viewbox="0 0 %d %d">
             %s
             %s
-            </svg>''' % (world.width, world.height,
-                         ''.join(cells), ''.join(agents))
+            </svg>''' % (world.width, world.height, walls + cells, agents)
         return svg
 
+    # The markup of one cell (walls & food)
+    def draw_cell(self, cell):
+        color = cell.color
+        if callable(color):
+            color = color()
+        markup = ''
+
+        # If the cell is a wall, then set its appearance to a blue rectangle
+        if cell.wall:
+            markup += ('<rect x=%d y=%d width=1 height=1 style="fill:%s"/>' %
+                       (cell.x, cell.y, color))
+
+        # If the cell is normal food, then set its appearance to a white circle
+        if cell.food:
+            markup += ('<circle cx=%d cy=%d r=0.4 style="fill:%s"/>' %
+                       (cell.x, cell.y, color))
+        return markup
+
+    # Everything the markup of an agent (ghost & pacman) depends on
+    def agent_key(self, agent):
+        return agent.x, agent.y, agent.dir, agent.typeBody, agent.size
+
+    # The markup of one agent, from its agent_key
+    def draw_agent(self, key):
+        x, y, dir, typeBody, size = key
+
+        # sets variables like agent direction and size
+        direction = dir * 360.0 / self.layers.world.directions
+        s = size * 2
+
+        if self.compact:
+            num = display.svg_number
+            sprite = self.layers.sprite((typeBody, size), (
+                '<image id="%%s" xlink:href="local/%s.png" x="%s" y="%s"'
+                ' width="%s" height="%s"/>'
+                % (typeBody, num(-s/2), num(-s/2), num(s), num(s))))
+            return ('<use xlink:href="#%s" transform="translate(%s,%s) rotate(%s)"/>'
+                    % (sprite, num(x+0.5), num(y+0.5), num(direction - 90)))
+
+        # Uses HTML rendering to setup the agents
+        return ('<image xlink:href="local/%s.png" x="%f" y="%f" '
+                ' width="%f" height="%f" transform="translate(%f,%f) rotate(%f)"/>'
+                % (typeBody, -s/2, -s/2, s, s, x+0.5, y+0.5, direction - 90))
+
+
+def make_grid_node(world, dt=0.001, headless=None, **kwargs):
+    '''Return a GridNode showing `world`, or None when running headless.
+
+    See display.running_headless for how `headless` is decided.
+    '''
+    if display.running_headless(headless):
+        return None
+    return GridNode(world, dt=dt, **kwargs)
+
 
 # Main Pacman World class
 class PacmanWorld(nengo.Network):
 
     def __init__(self, worldmap, pacman_speed=70, pacman_rotate=20,
-                 ghost_speed=5, ghost_rotate=5, dt=0.001,
-                 **kwargs):
+                 ghost_speed=5, ghost_rotate=5, dt=0.001, enemy_range=None,
+                 ghost_steering='direct', compact_svg=False, svg_fps=None,
+                 threaded_svg=False, headless=None, **kwargs):
 
         # Initializes PacmanWorld using parameters from the global pacman and ghost variables
         super(PacmanWorld, self).__init__(**kwargs)
@@ -128,25 +205,53 @@ class PacmanWorld(nengo.Network):
         self.ghost_speed = ghost_speed
         self.last_t = None
 
+        # Ghosts steer either 'direct'ly at the pacman, feeling their way around walls with their radar,
+        # or along the shortest paths of a 'flow' field of distances to the pacman's cell
+        if ghost_steering not in ('direct', 'flow'):
+            raise ValueError("ghost_steering must be 'direct' or 'flow'")
+        self.ghost_steering = ghost_steering
+        self.pursuit_target = None
+        self.pursuit_field = None
+        self.pursuit_reached_all = False
+
+        # The directions of the radar rays, relative to the way each body faces
+        self.pacman_angles = np.linspace(-0.5, 0.5, 3)
+        self.ghost_angles = np.linspace(-1, 1, 5)
+
         # Init for starting positions of the pacman and for food, etc.
-        starting = list(self.world.find_cells(lambda cell: cell.pacman_start))
+        starting = list(self.world.find_cells('pacman_start'))
         if len(starting) == 0:
-            starting = list(self.world.find_cells(lambda cell: cell.food))
+            starting = list(self.world.find_cells('food'))
         cell = random.choice(starting)
-        total = len(list(self.world.find_cells(lambda cell: cell.food)))
+        total = self.world.count('food')
         self.world.add(self.pacman, cell=cell, dir=3)
 
         # Adds a random amount of ghost enemies to the world
         self.enemies = []
-        for cell in self.world.find_cells(lambda cell: cell.enemy_start):
+        for cell in self.world.find_cells('enemy_start'):
             new = body.Player("ghost", "seeking", 0.37, "red", ghost_speed, ghost_rotate)
             self.world.add(new, cell=cell, dir=1)
             self.enemies.append(new)
         self.completion_time = None
 
+        # Moves the pacman and all of the ghosts together, each at its own speed
+        self.kinematics = continuous.Kinematics(
+            self.world, [self.pacman] + self.enemies,
+            speed=[pacman_speed] + [ghost_speed] * len(self.enemies))
+
+        # The starting state of the world, which reset() goes back to
+        self.initial_state = self.world.snapshot()
+
         # Sets up environment for the GridNode (this includes the nodes for obstacles and food)
+        # (with compact_svg the GridNode sends merged walls and reused agent images,
+        # at most svg_fps frames a second, drawn on a thread of their own with threaded_svg)
+        # A headless world, for runs without a GUI, has no GridNode or score display at all
+        # (see display.running_headless)
+        headless = display.running_headless(headless)
         with self:
-            self.environment = GridNode(self.world, dt=dt)
+            self.environment = make_grid_node(self.world, dt=dt, headless=headless,
+                                              compact=compact_svg, max_fps=svg_fps,
+                                              threaded=threaded_svg)
 
             #Pacman's move function -- called every 0.001 second (set using dt)
             def move(t, x):
@@ -157,21 +262,37 @@ class PacmanWorld(nengo.Network):
                 speed, rotation = x
                 dt = 0.001
 
-                # Pacman turns and moves forward based on obstacles and food availability
-                self.pacman.turn(rotation * dt * pacman_rotate)
-                self.pacman.go_forward(speed * dt * pacman_speed)
+                # Pacman turns and moves forward based on obstacles and food availability,
+                # while the ghosts steer away from the walls their radar sees (with a flow field,
+                # only those that are not seeking the pacman, since the rest follow the field)
+                if self.ghost_steering == 'flow':
+                    steering = [i for i, ghost in enumerate(self.enemies) if ghost.state != "seeking"]
+                    ghost_turn, ghost_forward = self.steer_ghosts(steering)
+                    self.kinematics.step(np.append(rotation * dt * pacman_rotate, ghost_turn),
+                                         np.append(speed * dt, ghost_forward),
+                                         [0] + [i + 1 for i in steering])
+                else:
+                    ghost_turn, ghost_forward = self.steer_ghosts()
+                    self.kinematics.step(np.append(rotation * dt * pacman_rotate, ghost_turn),
+                                         np.append(speed * dt, ghost_forward))
 
                 # If pacman moves into a cell containing food...
-                for n in self.pacman.cell.neighbours:
-                    if n.food:
+                world = self.world
+                cell = self.pacman.cell
+                food = world.fields['food']
+                index = cell.y * world.width + cell.x
+                for n in world.neighbour_table[index].tolist():
+                    if food.item(n):
                         # Adds to the score and updates ghosts
                         self.pacman.score += 1
-                        n.food = False
+                        world.get_cell_at(n).food = False
                         if self.completion_time is None and self.pacman.score == total:
                             self.completion_time = t
 
-                for ghost in self.enemies:
-                    self.update_ghost(ghost)
+                if self.ghost_steering == 'flow':
+                    self.chase_ghosts(self.pursuit_headings())
+                else:
+                    self.chase_ghosts()
 
             self.move = nengo.Node(move, size_in=2)
 
@@ -184,39 +305,38 @@ class PacmanWorld(nengo.Network):
                     html += '%1.3f seconds' % t
                 html = '<center>%s</center>' % html
                 score._nengo_html_ = html
-            self.score = nengo.Node(score)
+            self.score = None if headless else nengo.Node(score)
 
             # Sets up the node for the obstacles (this factors in angles and distances towards respective obstacles)
             def obstacles(t):
-                angles = np.linspace(-0.5, 0.5, 3) + self.pacman.dir
-                angles = angles % self.world.directions
-                self.pacman.obstacle_distances = [self.pacman.detect(d, max_distance=4*2)[0] for d in angles]
-                return self.pacman.obstacle_distances
+                pacman = self.pacman
+                distances = self.world.radar(pacman.x, pacman.y, pacman.dir,
+                                             self.pacman_angles, max_distance=4*2)
+                pacman.obstacle_distances = distances[0].tolist()
+                return pacman.obstacle_distances
             self.obstacles = nengo.Node(obstacles)
 
             # Sets up the node for the food (factors in amount of food in an area and its relative strength, distance, etc)
             def detect_food(t):
-                x = 0
-                y = 0
-
-                # Runs through the total number of cells in the world and calculates strength and relative distance for each one
-                for cell in self.world.find_cells(lambda cell:cell.food):
-                    dir = self.pacman.get_direction_to(cell)
-                    dist = self.pacman.get_distance_to(cell)
-                    rel_dir = dir - self.pacman.dir
-                    if dist > 5:
-                        continue
-                    if dist >= 0.05:
-                        strength = 1.0 / dist
-                    else:
-                        continue
-
-                    dx = np.sin(rel_dir * np.pi / 2) * strength
-                    dy = np.cos(rel_dir * np.pi / 2) * strength
-
-                    x += dx
-                    y += dy
-                return x, y
+                pacman = self.pacman
+                # Only the food within 5 units is sensed, so just the food
+                # buckets around pacman are looked at
+                food = self.world.get_buckets('food')
+                food = food.near(pacman.x, pacman.y, 5)
+                y, x = np.divmod(food, self.world.width)
+                dx = x - pacman.x
+                dy = y - pacman.y
+                dist2 = dx ** 2 + dy ** 2
+                near = dist2 >= 0.05 ** 2
+
+                # Each pellet pulls with strength 1/dist along its direction
+                # relative to pacman's heading; in a 4 direction world that is
+                # the sum of (dx, dy) / dist**2 turned by the heading
+                fx = (dx[near] / dist2[near]).sum()
+                fy = (dy[near] / dist2[near]).sum()
+                heading = pacman.dir * np.pi / 2
+                cos, sin = np.cos(heading), np.sin(heading)
+                return fx * cos + fy * sin, fx * sin - fy * cos
             self.detect_food = nengo.Node(detect_food)
 
             # Sets up the node for the enemies (factors in number of enemies in an area and their relative strength, distance, etc.)
@@ -224,8 +344,14 @@ class PacmanWorld(nengo.Network):
                 x = 0
                 y = 0
 
-                # Runs through the total number of ghosts in the world and calculates strength and relative distance for each one
-                for ghost in self.enemies:
+                # Runs through the ghosts in the world (or only those within enemy_range) and calculates strength and relative distance for each one
+                if enemy_range is None:
+                    ghosts = self.enemies
+                else:
+                    ghosts = self.world.occupancy.near(
+                        self.pacman.x, self.pacman.y, enemy_range,
+                        exclude=self.pacman)
+                for ghost in ghosts:
                     dir = self.pacman.get_direction_to(ghost)
                     dist = self.pacman.get_distance_to(ghost)
                     rel_dir = dir - self.pacman.dir
@@ -239,69 +365,122 @@ class PacmanWorld(nengo.Network):
                 return x, y
             self.detect_enemy = nengo.Node(detect_enemy)
 
-    # Updates the ghost's position every 0.001 second
-    def update_ghost(self, ghost):
+    # Distances to the walls around every ghost (or those with the given indices), one row of
+    # ghost_angles per ghost
+    def ghost_radar(self, which=None):
+        ghosts = self.enemies if which is None else [self.enemies[i] for i in which]
+        if not ghosts:
+            return np.zeros((0, len(self.ghost_angles)))
+        return self.world.radar([ghost.x for ghost in ghosts],
+                                [ghost.y for ghost in ghosts],
+                                [ghost.dir for ghost in ghosts],
+                                self.ghost_angles, max_distance=4*2)
+
+    # How far every ghost (or those with the given indices) turns and moves forward to keep away
+    # from the walls (its speed is applied when it moves)
+    def steer_ghosts(self, which=None):
         dt = 0.001
-        ghost.size=3
-
-        # Updates the ghost's position based on angles and distance towards the obstacles, etc.
-        angles = np.linspace(-1, 1, 5) + ghost.dir
-        angles = angles % self.world.directions
-        obstacle_distances = [ghost.detect(d, max_distance=4*2)[0] for d in angles]
-
-        ghost.turn((obstacle_distances[1]-obstacle_distances[3])*-2 * dt * self.ghost_rotate)
-        ghost.go_forward((obstacle_distances[2]-0.5)*2*self.ghost_speed * dt)
-
-        target_dir = ghost.get_direction_to(self.pacman)
-
-        # Factors in target distance and calls the turn and go_forward functions in that direction
-
-        # If the ghost is in a seeking condition, then it is turning towards the pacman and going forward
-        if(ghost.state == "seeking"):
-            theta = ghost.dir - target_dir
-            while theta > 2:
-                theta -= 4
-            while theta < -2:
-                theta += 4
-            ghost.turn(-theta * dt * self.ghost_rotate)
-            ghost.go_forward(self.ghost_speed * dt)
+        distances = self.ghost_radar(which)
+        turn = (distances[:, 1]-distances[:, 3])*-2 * dt * self.ghost_rotate
+        forward = (distances[:, 2]-0.5)*2 * dt
+        return turn, forward
+
+    # The way each ghost should head to follow the shortest path to the pacman: towards the centre of the
+    # next cell along it, read from a field of distances to the pacman's cell. The field is only searched
+    # again when the pacman enters a new cell, and the search stops once it has reached every ghost.
+    def pursuit_headings(self):
+        world = self.world
+        width = world.width
+        kinematics = self.kinematics
+        target = self.pacman.cell.y * width + self.pacman.cell.x
+        ghosts = kinematics.index[1:]
+
+        field = self.pursuit_field
+        if (target != self.pursuit_target or
+                (self.pursuit_reached_all and (field[ghosts] < 0).any())):
+            field = world.get_distance_field(target, until=ghosts)
+            self.pursuit_target = target
+            self.pursuit_field = field
+            # A search that reached every ghost may have stopped before covering the rest of the map,
+            # so it is searched again if a ghost wanders outside it
+            self.pursuit_reached_all = bool((field[ghosts] >= 0).all())
+
+        # Step to the neighbour one closer to the pacman; ghosts already in the pacman's cell, or cut off
+        # from it, head straight for it instead
+        neighbours = world.neighbour_table[ghosts]
+        distances = field[neighbours]
+        distances = np.where(distances >= 0, distances, np.iinfo(distances.dtype).max)
+        step = neighbours[np.arange(len(ghosts)), np.argmin(distances, axis=1)]
+        y, x = np.divmod(step, width)
+        following = field[ghosts] > 0
+        x = np.where(following, x, self.pacman.x)
+        y = np.where(following, y, self.pacman.y)
+
+        # The same angle as get_direction_to
+        theta = np.arctan2(y - kinematics.y[1:], x - kinematics.x[1:]) + np.pi/2
+        return theta * world.directions / (2 * np.pi) % world.directions
+
+    # Turns every ghost towards (seeking) or away from (running) the pacman and moves them all forward together.
+    # Seeking ghosts given headings turn straight onto them instead.
+    def chase_ghosts(self, headings=None):
+        dt = 0.001
+        turn = []
+        which = []
+        seeking = []
+        for i, ghost in enumerate(self.enemies):
+            ghost.size=3
+            target_dir = ghost.get_direction_to(self.pacman)
+
+            if(ghost.state == "seeking" and headings is not None):
+                turn.append((headings[i] - ghost.dir) % self.world.directions)
+                seeking.append(ghost)
+            elif(ghost.state == "seeking"):
+                theta = ghost.dir - target_dir
+                while theta > 2:
+                    theta -= 4
+                while theta < -2:
+                    theta += 4
+                turn.append(-theta * dt * self.ghost_rotate)
+                seeking.append(ghost)
+            elif(ghost.state == "running"):
+                if ghost.get_distance_to(self.pacman) < 1:
+                    ghost.state = "seeking"
+                    ghost.cell = random.choice(list(self.world.find_cells('enemy_start')))
+                    self.kinematics.pull([i + 1])
+                theta = ghost.dir - target_dir
+                while theta > 2: theta -= 4
+                while theta < -2: theta += 4
+                turn.append(360-( -theta * dt * self.ghost_rotate))
+            else:
+                continue
+            # the pacman is the first body the kinematics moves
+            which.append(i + 1)
+
+        if which:
+            self.kinematics.step(np.array(turn), dt, np.array(which))
+
+        # A seeking ghost that reaches the pacman sends everyone back to the start
+        for ghost in seeking:
             if ghost.get_distance_to(self.pacman) < 2:
                 self.reset()
-
-        # If the ghost is in a running condition, then it is turning away from the pacman and going forward
-        elif(ghost.state == "running"):
-            starting = list(self.world.find_cells(lambda cell: cell.enemy_start))
-            if ghost.get_distance_to(self.pacman) < 1:
-                ghost.state = "seeking"
-                ghost.cell = random.choice(starting)
-            theta = ghost.dir - target_dir
-            while theta > 2: theta -= 4
-            while theta < -2: theta += 4
-            ghost.turn(360-( -theta * dt * self.ghost_rotate))
-            ghost.go_forward(self.ghost_speed * dt)
+                break
 
     # Resets the pacman's position after it loses
     def reset(self):
         self.pacman.score = 0
         self.completion_time = None
 
-        # Runs through the rows in the world and reinializes cells
-        for row in self.world.grid:
-            for cell in row:
-                if not (cell.wall or cell.pacman_start or cell.enemy_start) and (cell.state == "food"):
-                    cell.food = True
+        # Restores the food, the ghosts and the age of the world in one go
+        self.world.restore(self.initial_state)
 
         # reinializes the starting position of the pacman
-        starting = list(self.world.find_cells(lambda cell: cell.pacman_start))
+        starting = list(self.world.find_cells('pacman_start'))
         if len(starting) == 0:
-            starting = list(self.world.find_cells(lambda cell: cell.food))
+            starting = list(self.world.find_cells('food'))
         self.pacman.cell = random.choice(starting)
         self.pacman.x = self.pacman.cell.x
         self.pacman.y = self.pacman.cell.y
         self.pacman.dir = 3
 
-        for i, cell in enumerate(self.world.find_cells(lambda cell: cell.enemy_start)):
-            self.enemies[i].cell = cell
-            self.enemies[i].dir = 1
-            self.enemies[i].x = cell.x
-            self.enemies[i].y = cell.y
+        # Everything has moved, so the kinematics reads all the poses again
+        self.kinematics.pull()
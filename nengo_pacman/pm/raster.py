@@ -0,0 +1,291 @@
+import os
+import pickle
+
+import numpy as np
+
+from pm import cellular
+
+# RGB values for the colour names used by the Cells and Players
+color_names = {
+    'black': (0, 0, 0),
+    'white': (255, 255, 255),
+    'blue': (0, 0, 255),
+    'red': (255, 0, 0),
+    'green': (0, 128, 0),
+    'yellow': (255, 255, 0),
+    'orange': (255, 165, 0),
+    'pink': (255, 192, 203),
+    'cyan': (0, 255, 255),
+    'gray': (128, 128, 128),
+}
+
+
+def rgb(color):
+    '''Return `color` (a name, '#rrggbb' or an RGB tuple) as RGB bytes.'''
+    if isinstance(color, str):
+        if color.startswith('#') and len(color) == 7:
+            return tuple(int(color[i:i + 2], 16) for i in (1, 3, 5))
+        return color_names[color.lower()]
+    return tuple(int(c) for c in color)
+
+
+def disc(size, radius, cx, cy):
+    '''Return a (size, size) mask of the pixels within `radius` of (cx, cy).
+
+    Pixel (i, j) is the unit square with its top left corner at (j, i), so
+    the test is made at its centre.
+    '''
+    y, x = np.ogrid[:size, :size]
+    return (x + 0.5 - cx) ** 2 + (y + 0.5 - cy) ** 2 <= radius * radius
+
+
+class RasterRenderer:
+    '''Draws a World into an RGB image, `scale` pixels to a cell.
+
+    The walls and food are drawn straight from the World's fields, with
+    one palette lookup over the whole image, and each Agent is a disc of
+    its `color` and `size`, as big as its image in the SVG.  The image is
+    a (height * scale, width * scale, 3) uint8 array.
+    '''
+
+    def __init__(self, world, scale=4, background='black', wall='blue',
+                 food='white', agent='yellow'):
+        self.world = world
+        self.scale = scale
+        self.shape = (world.height * scale, world.width * scale, 3)
+        self.palette = np.array([rgb(background), rgb(wall), rgb(food)],
+                                dtype=np.uint8)
+        self.agent = agent
+        # food is a dot of radius 0.4 in the middle of its cell
+        self.food = disc(scale, 0.4 * scale, scale / 2.0, scale / 2.0)
+
+    def render(self, out=None):
+        '''Draw the World into `out` (a new array by default) and return it.'''
+        world = self.world
+        scale = self.scale
+        if out is None:
+            out = np.empty(self.shape, dtype=np.uint8)
+
+        # 0 is background, 1 wall and 2 food, for every pixel
+        walls = np.asarray(world.fields['wall'], dtype=bool)
+        labels = np.zeros((world.height, scale, world.width, scale),
+                          dtype=np.uint8)
+        blocks = labels.transpose(0, 2, 1, 3)
+        if 'food' in world.fields:
+            food = np.asarray(world.fields['food'], dtype=bool) & ~walls
+            blocks[food] = self.food * np.uint8(2)
+        blocks[walls] = 1
+        np.take(self.palette, labels.reshape(self.shape[:2]), axis=0,
+                out=out)
+
+        for agent in world.agents:
+            self.draw_agent(out, agent)
+        return out
+
+    def draw_agent(self, image, agent):
+        scale = self.scale
+        radius = getattr(agent, 'size', 0.4) * scale
+        cx = (agent.x + 0.5) * scale
+        cy = (agent.y + 0.5) * scale
+        x0 = max(int(cx - radius), 0)
+        y0 = max(int(cy - radius), 0)
+        x1 = min(int(cx + radius) + 1, image.shape[1])
+        y1 = min(int(cy + radius) + 1, image.shape[0])
+        if x0 >= x1 or y0 >= y1:
+            return
+        y, x = np.ogrid[y0:y1, x0:x1]
+        mask = (x + 0.5 - cx) ** 2 + (y + 0.5 - cy) ** 2 <= radius * radius
+        image[y0:y1, x0:x1][mask] = rgb(getattr(agent, 'color', self.agent))
+
+
+frames_magic = b'PMFRAME1'
+
+# the kinds of record in a delta recording
+KEY_FRAME = 1
+DELTA_FRAME = 2
+
+
+class FrameRecorder:
+    '''Appends the frames of a RasterRenderer to a memory-mapped file.
+
+    Called as the function of a Node, it records a frame every `interval`
+    seconds of simulation time.  The file is grown `chunk` bytes at a time
+    and mapped into memory, so whole frames are rendered straight into
+    it.  With `delta`, a frame only stores the runs of pixels that changed
+    since the frame before, with a whole frame every `keyframe` frames,
+    which is far smaller when little moves.  The number of frames is kept
+    up to date in the file, so it can be read with `iter_frames` even
+    while recording or after a crash; close() trims the unused end.
+    '''
+
+    def __init__(self, path, renderer, interval=0.1, delta=False,
+                 keyframe=100, chunk=1 << 24):
+        self.path = path
+        self.renderer = renderer
+        self.interval = interval
+        self.delta = delta
+        self.keyframe = keyframe
+        self.chunk = chunk
+        self.shape = renderer.shape
+        self.frame_size = int(np.prod(self.shape))
+        self.last_t = None
+        self.previous = None
+        self.current = None
+
+        header = {'shape': self.shape, 'delta': delta, 'interval': interval}
+        head = pickle.dumps(header, protocol=2)
+        self.start = len(frames_magic) + 16 + len(head)
+        self.start += -self.start % 64
+        self.file = open(path, 'w+b')
+        self.file.write(frames_magic)
+        self.file.write(np.uint64(self.start).tobytes())
+        self.file.write(np.uint64(0).tobytes())
+        self.file.write(head)
+        self.file.write(b'\0' * (self.start - self.file.tell()))
+        self.file.flush()
+        self.counter = np.memmap(self.file, dtype=np.uint64, mode='r+',
+                                 offset=len(frames_magic) + 8, shape=(1,))
+        self.data = None
+        self.size = 0
+        self.count = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def __call__(self, t):
+        if self.last_t is not None and t <= self.last_t:
+            self.last_t = None
+        if self.last_t is None or t >= self.last_t + self.interval:
+            self.record()
+            self.last_t = t
+
+    def record(self):
+        '''Render the World now and append the frame.'''
+        if not self.delta:
+            frame = self._reserve(self.frame_size).reshape(self.shape)
+            self.renderer.render(out=frame)
+        else:
+            if self.current is None:
+                self.current = np.empty(self.shape, dtype=np.uint8)
+            frame = self.renderer.render(out=self.current)
+            if self.previous is None or self.count % self.keyframe == 0:
+                self._append(KEY_FRAME, [frame.reshape(-1)])
+            else:
+                self._append(DELTA_FRAME, encode_delta(self.previous, frame))
+            self.current, self.previous = self.previous, frame
+        self.count += 1
+        self.counter[0] = self.count
+
+    def close(self):
+        '''Trim the file to the frames recorded and close it.'''
+        if self.file is None:
+            return
+        self.data = None
+        self.counter.flush()
+        self.counter = None
+        self.file.truncate(self.start + self.size)
+        self.file.close()
+        self.file = None
+
+    def _append(self, kind, parts):
+        # a record is its kind and length, then its parts, padded to 8
+        # bytes so the next one is aligned
+        nbytes = sum(part.nbytes for part in parts)
+        record = self._reserve(16 + nbytes + -nbytes % 8)
+        record[:16] = np.array([kind, nbytes], dtype=np.uint64).view(np.uint8)
+        offset = 16
+        for part in parts:
+            record[offset:offset + part.nbytes] = part.view(np.uint8).reshape(-1)
+            offset += part.nbytes
+
+    def _reserve(self, nbytes):
+        # the next `nbytes` of the file, mapped into memory
+        end = self.size + nbytes
+        if self.data is None or end > len(self.data):
+            capacity = 0 if self.data is None else len(self.data)
+            capacity = max(end, capacity + self.chunk)
+            self.data = None
+            self.file.truncate(self.start + capacity)
+            self.data = np.memmap(self.file, dtype=np.uint8, mode='r+',
+                                  offset=self.start, shape=(capacity,))
+        view = self.data[self.size:end]
+        self.size = end
+        return view
+
+
+def encode_delta(previous, frame):
+    '''Return the runs of pixels of `frame` that differ from `previous`.
+
+    The parts are the number of runs, their first pixels and lengths (all
+    uint32) and the RGB values of the pixels in them, in order.
+    '''
+    before = previous.reshape(-1, 3)
+    after = frame.reshape(-1, 3)
+    changed = (before != after).any(axis=1)
+    edges = np.diff(np.concatenate(([0], changed.view(np.int8), [0])))
+    starts = np.flatnonzero(edges == 1).astype(np.uint32)
+    ends = np.flatnonzero(edges == -1).astype(np.uint32)
+    return [np.array([len(starts)], dtype=np.uint32), starts, ends - starts,
+            after[changed]]
+
+
+def apply_delta(frame, payload):
+    '''Write the runs from a delta record's `payload` into `frame`.'''
+    n = int(payload[:4].view(np.uint32)[0])
+    starts = payload[4:4 + 4 * n].view(np.uint32).astype(np.intp)
+    lengths = payload[4 + 4 * n:4 + 8 * n].view(np.uint32).astype(np.intp)
+    values = payload[4 + 8 * n:].reshape(-1, 3)
+    # the pixel index of every value: each run counts up from its start
+    ends = np.cumsum(lengths)
+    pixels = np.arange(ends[-1] if n else 0) + np.repeat(starts - ends + lengths,
+                                                         lengths)
+    frame.reshape(-1, 3)[pixels] = values
+
+
+def read_header(path):
+    '''Return (header, number of frames, data offset) of a recording.'''
+    with open(path, 'rb') as f:
+        if f.read(len(frames_magic)) != frames_magic:
+            raise cellular.CellularException(
+                '%s is not a frame recording' % path)
+        start, count = np.frombuffer(f.read(16), dtype=np.uint64).tolist()
+        header = pickle.loads(f.read(start - len(frames_magic) - 16))
+    return header, count, start
+
+
+def iter_frames(path):
+    '''Yield the frames recorded at `path` by a FrameRecorder, in order.
+
+    Frames of a plain recording are views of the memory-mapped file.
+    Frames of a delta recording are decoded into one array, which is
+    reused for the next frame, so copy a frame to keep it.
+    '''
+    header, count, start = read_header(path)
+    if count == 0:
+        return
+    shape = tuple(header['shape'])
+    data = np.memmap(path, dtype=np.uint8, mode='r', offset=start,
+                     shape=(os.path.getsize(path) - start,))
+    if not header['delta']:
+        size = int(np.prod(shape))
+        for frame in data[:count * size].reshape((count,) + shape):
+            yield frame
+        return
+
+    frame = np.zeros(shape, dtype=np.uint8)
+    offset = 0
+    for i in range(count):
+        kind, nbytes = data[offset:offset + 16].view(np.uint64).tolist()
+        payload = data[offset + 16:offset + 16 + nbytes]
+        if kind == KEY_FRAME:
+            frame.reshape(-1)[:] = payload
+        elif kind == DELTA_FRAME:
+            apply_delta(frame, payload)
+        else:
+            raise cellular.CellularException(
+                '%s has a broken record at frame %d' % (path, i))
+        yield frame
+        offset += 16 + nbytes + -nbytes % 8
@@ -0,0 +1,7 @@
+import os
+import sys
+
+root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+for path in (root, os.path.join(root, 'nengo_pacman')):
+    if path not in sys.path:
+        sys.path.insert(0, path)
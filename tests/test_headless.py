@@ -0,0 +1,56 @@
+import random
+
+import nengo
+import numpy as np
+import pytest
+
+import grid
+import td_grid
+from pm import maze
+from pm import pacman_world
+
+room = """
+#####
+#   #
+# G #
+#####
+"""
+
+
+@pytest.mark.parametrize('module', [grid, td_grid])
+def test_make_grid_node(module, monkeypatch):
+    world = module.World(module.GridCell, map=room, directions=4)
+    monkeypatch.delenv('NENGO_HEADLESS', raising=False)
+    with nengo.Network():
+        assert isinstance(module.make_grid_node(world), module.GridNode)
+        assert module.make_grid_node(world, headless=True) is None
+        monkeypatch.setenv('NENGO_HEADLESS', '1')
+        assert module.make_grid_node(world) is None
+        assert isinstance(module.make_grid_node(world, headless=False),
+                          module.GridNode)
+
+
+def run_pacman(**kwargs):
+    with nengo.Network(seed=0) as model:
+        world = pacman_world.PacmanWorld(
+            maze.generateMaze(num_rows=4, num_cols=4, num_ghosts=2, seed=0),
+            **kwargs)
+        nengo.Connection(nengo.Node([1, 0.3]), world.move, synapse=None)
+        probes = [nengo.Probe(world.obstacles), nengo.Probe(world.detect_food),
+                  nengo.Probe(world.detect_enemy)]
+    with nengo.Simulator(model, progress_bar=False) as sim:
+        sim.run(0.05)
+    return world, [sim.data[p] for p in probes]
+
+
+def test_headless_pacman_world_senses_the_same():
+    random.seed(0)
+    np.random.seed(0)
+    shown, shown_data = run_pacman(headless=False)
+    random.seed(0)
+    np.random.seed(0)
+    headless, headless_data = run_pacman(headless=True)
+    assert headless.environment is None and headless.score is None
+    assert len(headless.all_nodes) == len(shown.all_nodes) - 2
+    for a, b in zip(shown_data, headless_data):
+        assert np.allclose(a, b)
@@ -0,0 +1,69 @@
+import numpy as np
+import pytest
+
+from pm import cellular
+from pm import continuous
+from pm import maze
+from pm import pacman_world
+
+
+def make_bodies(world, count, seed):
+    rng = np.random.RandomState(seed)
+    free = np.flatnonzero(~world.fields['wall'].reshape(-1))
+    bodies = []
+    for i in rng.choice(free, count, replace=False):
+        y, x = divmod(int(i), world.width)
+        body = continuous.Body()
+        world.add(body, x=x, y=y, dir=rng.randint(4))
+        bodies.append(body)
+    return bodies
+
+
+def pose(body):
+    return body.x, body.y, body.dir, body.cell.x, body.cell.y
+
+
+@pytest.mark.parametrize('packed', [False, True])
+@pytest.mark.parametrize('slide', [False, True])
+def test_step_matches_moving_bodies_one_at_a_time(slide, packed):
+    walls = np.asarray(maze.generateWalls(3, 3, seed=1))
+    batched = cellular.World(pacman_world.Cell, walls=walls, directions=4,
+                             packed=packed, compact=packed)
+    single = cellular.World(pacman_world.Cell, walls=walls, directions=4)
+    bodies = make_bodies(batched, 40, seed=0)
+    others = make_bodies(single, 40, seed=0)
+    kinematics = continuous.Kinematics(batched, bodies)
+    rng = np.random.RandomState(1)
+    for step in range(30):
+        turn = rng.uniform(-0.5, 0.5, 40)
+        # mostly short moves, and a few that have to be swept
+        forward = rng.uniform(0, 0.6, 40)
+        forward[rng.rand(40) < 0.1] = 3
+        which = rng.rand(40) < 0.8
+        moved = kinematics.step(turn[which], forward[which], which=which,
+                                slide=slide)
+        expected = []
+        for body, t, f in zip(np.array(others)[which], turn[which],
+                              forward[which]):
+            body.turn(t)
+            expected.append(body.go_forward(f, slide=slide))
+        assert moved.tolist() == expected
+        for a, b in zip(bodies, others):
+            assert np.allclose(pose(a), pose(b))
+
+
+def test_pull_reads_bodies_moved_outside_step():
+    walls = np.asarray(maze.generateWalls(3, 3, seed=1))
+    world = cellular.World(pacman_world.Cell, walls=walls, directions=4)
+    bodies = make_bodies(world, 20, seed=0)
+    kinematics = continuous.Kinematics(world, bodies)
+    body = bodies[3]
+    start = pose(body)
+    body.go_forward(0.4)
+    moved = pose(body)
+    assert kinematics.x[3] == start[0] and kinematics.y[3] == start[1]
+    # step() works from the arrays, so it has to be told about the move
+    kinematics.pull([3])
+    assert kinematics.x[3] == moved[0] and kinematics.y[3] == moved[1]
+    kinematics.step(0.0, 0.0)
+    assert np.allclose(pose(body), moved)
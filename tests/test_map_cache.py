@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+import grid
+import td_grid
+from pm import cellular
+from pm import pacman_world
+
+td_map = """
+#######
+#     #
+#  G  #
+#     #
+#######
+"""
+
+grid_map = """
+#######
+#     #
+# # # #
+#G   R#
+#######
+"""
+
+
+@pytest.mark.parametrize('module, cell, mymap', [
+    (td_grid, td_grid.GridCell, td_map),
+    (grid, grid.GridCell, grid_map),
+    (cellular, pacman_world.Cell, grid_map.replace('G', 'S')),
+])
+def test_cached_map_loads_the_same_fields(tmp_path, module, cell, mymap):
+    first = module.World(cell, map=mymap, directions=4,
+                         cache_dir=str(tmp_path))
+    assert len(list(tmp_path.iterdir())) == 1
+    second = module.World(cell, map=mymap, directions=4,
+                          cache_dir=str(tmp_path))
+    assert isinstance(second.fields['wall'], np.memmap)
+    plain = module.World(cell, map=mymap, directions=4)
+    for world in (first, second):
+        assert sorted(world.fields) == sorted(plain.fields)
+        for name in plain.fields:
+            assert np.array_equal(np.asarray(world.fields[name]),
+                                  np.asarray(plain.fields[name])), name
+
+
+def test_cached_td_grid_map_keeps_its_rewards(tmp_path):
+    for i in range(2):
+        world = td_grid.World(td_grid.GridCell, map=td_map, directions=4,
+                              cache_dir=str(tmp_path))
+        assert world.get_cell(3, 2).reward == 1
+        assert np.abs(world.fields['reward']).sum() == 1
+
+
+def wall_cell():
+    class Cell(pacman_world.Cell):
+        __slots__ = ()
+
+        def load(self, char):
+            if char == 'x':
+                self.wall = True
+    return Cell
+
+
+def food_cell():
+    # the same byte code and constants as wall_cell; only a name differs
+    class Cell(pacman_world.Cell):
+        __slots__ = ()
+
+        def load(self, char):
+            if char == 'x':
+                self.food = True
+    return Cell
+
+
+def test_cells_that_load_differently_do_not_share_a_cache(tmp_path):
+    mymap = 'xxxx\nxxxx'
+    walls = cellular.World(wall_cell(), map=mymap, directions=4,
+                           cache_dir=str(tmp_path))
+    food = cellular.World(food_cell(), map=mymap, directions=4,
+                          cache_dir=str(tmp_path))
+    assert walls._get_map_key(['xxxx'] * 2) != food._get_map_key(['xxxx'] * 2)
+    assert len(list(tmp_path.iterdir())) == 2
+    assert walls.fields['wall'].sum() == 8 and walls.fields['food'].sum() == 0
+    assert food.fields['wall'].sum() == 0 and food.fields['food'].sum() == 8
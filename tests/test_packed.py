@@ -0,0 +1,115 @@
+import random
+
+import numpy as np
+import pytest
+
+from pm import cellular
+from pm import continuous
+from pm import maze
+from pm import pacman_world
+
+
+def make_worlds(seed=1):
+    walls = maze.generateWalls(6, 6, seed=seed)
+    normal = cellular.World(pacman_world.Cell, walls=np.asarray(walls),
+                            directions=4)
+    packed = cellular.World(pacman_world.Cell, walls=walls, packed=True,
+                            compact=True, directions=4)
+    return normal, packed
+
+
+def test_packed_world_matches_normal_world():
+    normal, packed = make_worlds()
+    assert isinstance(packed.fields['wall'], cellular.BitField)
+    assert np.array_equal(np.asarray(packed.fields['wall']),
+                          normal.fields['wall'])
+    assert np.array_equal(packed.neighbour_table[np.arange(100)],
+                          normal.neighbour_table[np.arange(100)])
+    x = np.array([5.5, 20.0, 31.2])
+    y = np.array([5.0, 12.3, 40.0])
+    angles = np.linspace(-1, 1, 5)
+    for a, b in zip(normal.radar(x, y, 1.0, angles, max_distance=30),
+                    packed.radar(x, y, 1.0, angles, max_distance=30)):
+        assert np.allclose(a, b)
+
+
+def test_bitfield_round_trip():
+    rng = np.random.RandomState(0)
+    array = rng.rand(7, 13) < 0.4
+    field = cellular.BitField.from_array(array)
+    assert np.array_equal(np.asarray(field), array)
+    assert np.array_equal(field.flatnonzero(), np.flatnonzero(array))
+    assert np.array_equal(field.flatnonzero(invert=True),
+                          np.flatnonzero(~array))
+    field[3, 4] = not array[3, 4]
+    assert field.item(3, 4) == (not array[3, 4])
+
+
+def test_add_on_packed_world_does_not_index_free_cells():
+    random.seed(0)
+    normal, packed = make_worlds()
+    for i in range(20):
+        body = continuous.Body()
+        packed.add(body)
+        assert not packed.fields['wall'].item(body.y, body.x)
+    assert 'free' not in packed._indexes
+
+
+def test_packed_neighbour_table_matches_normal_world():
+    normal, packed = make_worlds()
+    table = packed.neighbour_table
+    n = len(table)
+    assert np.array_equal(np.asarray(table), normal.neighbour_table)
+    assert np.array_equal(table[:5], normal.neighbour_table[:5])
+    assert np.array_equal(table[-1], normal.neighbour_table[-1])
+    assert table.item(-1, 2) == normal.neighbour_table[-1, 2]
+    for index in (n, 10 * n, -n - 1, [0, n]):
+        with pytest.raises(IndexError):
+            table[index]
+    with pytest.raises(IndexError):
+        table.item(n, 0)
+
+
+class Spread(cellular.Cell):
+    __slots__ = ()
+    food = False
+
+    @staticmethod
+    def kernel(world, state, out):
+        out['food'][:] = state['food'][world.neighbour_table].any(axis=1)
+
+
+def test_kernel_update_on_packed_world():
+    normal = cellular.World(Spread, 10, 10)
+    packed = cellular.World(Spread, 10, 10, packed=True, compact=True)
+    for world in (normal, packed):
+        world.get_cell(3, 3).food = True
+        world.update()
+    assert (sorted(packed.get_index('food').array()) ==
+            sorted(normal.get_index('food').array()))
+    assert packed.count('food') == 8
+
+
+def test_packed_world_refuses_whole_map_tables():
+    normal, packed = make_worlds()
+    with pytest.raises(cellular.CellularException):
+        packed.get_wall_distances()
+    with pytest.raises(cellular.CellularException):
+        packed.get_distance_field(packed.get_cell(1, 1))
+
+
+def test_pacman_cell_state_outlives_its_food():
+    lines = ['#' * 7] + ['#     #'] * 5 + ['#' * 7]
+    for packed in (False, True):
+        world = cellular.World(pacman_world.Cell, map='\n'.join(lines),
+                               packed=packed, compact=packed)
+        assert 'state' not in world.fields
+        cell = world.get_cell(5, 5)
+        assert cell.food and cell.state == 'food'
+        cell.food = False
+        assert cell.state == 'food'
+        cell.state = None
+        assert cell.state is None and not cell.food_start
+        assert world.get_cell(1, 1).state is None
+        with pytest.raises(ValueError):
+            cell.state = 'wall'
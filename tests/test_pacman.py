@@ -0,0 +1,135 @@
+import math
+import random
+
+import nengo
+import numpy as np
+import pytest
+
+from pm import maze
+from pm import pacman_world
+
+from test_paths import breadth_first
+
+
+def make_pacman(**kwargs):
+    random.seed(0)
+    worldmap = maze.generateMaze(num_rows=4, num_cols=4, num_ghosts=3, seed=1)
+    with nengo.Network():
+        return pacman_world.PacmanWorld(worldmap, headless=True, **kwargs)
+
+
+def test_flow_headings_follow_shortest_paths():
+    pacman = make_pacman(ghost_steering='flow')
+    world = pacman.world
+    cells = np.flatnonzero(~world.fields['wall'].reshape(-1))
+    rng = np.random.RandomState(0)
+    for i in range(5):
+        for body in [pacman.pacman] + pacman.enemies[i % 2:]:
+            body.cell = world.get_cell_at(int(rng.choice(cells)))
+            body.x = body.cell.x + rng.uniform(-0.3, 0.3)
+            body.y = body.cell.y + rng.uniform(-0.3, 0.3)
+        pacman.kinematics.pull()
+        headings = pacman.pursuit_headings()
+        target = pacman.pacman.cell.y * world.width + pacman.pacman.cell.x
+        field = breadth_first(world, target)
+        for ghost, heading in zip(pacman.enemies, headings):
+            here = ghost.cell.y * world.width + ghost.cell.x
+            if field[here] <= 0:
+                x, y = pacman.pacman.x, pacman.pacman.y
+            else:
+                # the centre of a neighbour one step closer
+                steps = [n for n in world.neighbour_table[here].tolist()
+                         if field[n] == field[here] - 1]
+                y, x = divmod(steps[0], world.width)
+            theta = math.atan2(y - ghost.y, x - ghost.x) + math.pi / 2
+            assert np.isclose(heading, theta * 2 / math.pi % 4)
+
+
+def test_unknown_ghost_steering_is_refused():
+    with pytest.raises(ValueError):
+        make_pacman(ghost_steering='teleport')
+
+
+def test_food_sensing_matches_all_food_in_range():
+    pacman = make_pacman()
+    world = pacman.world
+    body = pacman.pacman
+    rng = np.random.RandomState(2)
+    cells = np.flatnonzero(~world.fields['wall'].reshape(-1))
+    for i in range(20):
+        body.cell = world.get_cell_at(int(rng.choice(cells)))
+        body.x = body.cell.x + rng.uniform(-0.4, 0.4)
+        body.y = body.cell.y + rng.uniform(-0.4, 0.4)
+        body.dir = rng.uniform(0, 4)
+        # eat some food, so the cached food buckets have to follow
+        world.get_cell_at(int(rng.choice(cells))).food = False
+
+        fx = fy = 0
+        for cell in world.find_cells(lambda c: c.food):
+            dx, dy = cell.x - body.x, cell.y - body.y
+            dist2 = dx ** 2 + dy ** 2
+            if 0.05 ** 2 <= dist2 <= 25:
+                fx += dx / dist2
+                fy += dy / dist2
+        heading = body.dir * np.pi / 2
+        expected = (fx * np.cos(heading) + fy * np.sin(heading),
+                    fx * np.sin(heading) - fy * np.cos(heading))
+        assert np.allclose(pacman.detect_food.output(0.0), expected)
+
+
+
+def baseline_food_sensing(pacman):
+    # detect_food as it was first written, one food cell at a time
+    body = pacman.pacman
+    x = y = 0
+    for cell in pacman.world.find_cells(lambda c: c.food):
+        dir = body.get_direction_to(cell)
+        dist = body.get_distance_to(cell)
+        rel_dir = dir - body.dir
+        if dist > 5 or dist < 0.05:
+            continue
+        strength = 1.0 / dist
+        x += np.sin(rel_dir * np.pi / 2) * strength
+        y += np.cos(rel_dir * np.pi / 2) * strength
+    return x, y
+
+
+def test_food_sensing_matches_the_baseline_after_a_reset():
+    pacman = make_pacman()
+    world = pacman.world
+    body = pacman.pacman
+    rng = np.random.RandomState(3)
+    cells = np.flatnonzero(~world.fields['wall'].reshape(-1))
+    food = world.fields['food'].copy()
+    for i in range(10):
+        body.cell = world.get_cell_at(int(rng.choice(cells)))
+        body.x = body.cell.x + rng.uniform(-0.4, 0.4)
+        body.y = body.cell.y + rng.uniform(-0.4, 0.4)
+        body.dir = rng.uniform(0, 4)
+        assert np.allclose(pacman.detect_food.output(0.0),
+                           baseline_food_sensing(pacman))
+        for n in world.neighbour_table[body.cell.y * world.width +
+                                       body.cell.x].tolist():
+            world.get_cell_at(n).food = False
+        if i % 3 == 2:
+            # the food comes back, and the buckets have to follow
+            pacman.reset()
+            assert np.array_equal(world.fields['food'], food)
+
+
+def test_running_ghosts_steer_the_same_with_a_flow_field():
+    poses = []
+    for steering in ('direct', 'flow'):
+        pacman = make_pacman(ghost_steering=steering)
+        # building the move node has already moved the ghosts once
+        random.seed(0)
+        pacman.reset()
+        for ghost in pacman.enemies:
+            ghost.state = 'running'
+        start = [(ghost.x, ghost.y) for ghost in pacman.enemies]
+        for i in range(300):
+            pacman.move.output(i * 0.001, [0.0, 0.0])
+        poses.append([(ghost.x, ghost.y, ghost.dir)
+                      for ghost in pacman.enemies])
+    assert np.allclose(poses[0], poses[1])
+    assert [(x, y) for x, y, dir in poses[1]] != start
@@ -0,0 +1,106 @@
+import collections
+
+import numpy as np
+import pytest
+
+from pm import cellular
+from pm import maze
+from pm import pacman_world
+
+
+def make_world(seed=0, **kwargs):
+    walls = np.asarray(maze.generateWalls(2, 2, seed=seed))
+    # a cell walled in on every side, which nothing can reach
+    walls[1:4, 1:4] = True
+    walls[2, 2] = False
+    return cellular.World(pacman_world.Cell, walls=walls, directions=4,
+                          **kwargs)
+
+
+def breadth_first(world, target):
+    walls = world.fields['wall'].reshape(-1)
+    distances = {target: 0}
+    queue = collections.deque([target])
+    while queue:
+        i = queue.popleft()
+        for n in world.neighbour_table[i].tolist():
+            if n not in distances and not walls[n]:
+                distances[n] = distances[i] + 1
+                queue.append(n)
+    field = np.full(world.width * world.height, -1)
+    for i, d in distances.items():
+        field[i] = d
+    return field
+
+
+def free_cells(world):
+    return np.flatnonzero(~world.fields['wall'].reshape(-1)).tolist()
+
+
+def test_distance_field_matches_breadth_first_search():
+    world = make_world()
+    for target in free_cells(world)[::7]:
+        assert np.array_equal(world.get_distance_field(target),
+                              breadth_first(world, target))
+    # the fields kept are dropped when a wall changes
+    target = free_cells(world)[5]
+    world.get_distance_field(target)
+    world.get_cell(10, 10).wall = not world.get_cell(10, 10).wall
+    assert np.array_equal(world.get_distance_field(target),
+                          breadth_first(world, target))
+
+
+def test_partial_distance_field_reaches_the_cells_asked_for():
+    world = make_world()
+    cells = free_cells(world)
+    target = cells[0]
+    until = cells[10:13]
+    field = world.get_distance_field(target, until=until)
+    full = breadth_first(world, target)
+    assert np.array_equal(field[until], full[until])
+    reached = field >= 0
+    assert np.array_equal(field[reached], full[reached])
+
+
+@pytest.mark.parametrize('map_tables', [True, False])
+def test_paths_are_shortest(map_tables):
+    world = make_world()
+    world.map_tables = map_tables
+    width = world.width
+    cells = free_cells(world)
+    rng = np.random.RandomState(0)
+    for i in range(20):
+        start, goal = rng.choice(cells, 2)
+        field = breadth_first(world, goal)
+        start_cell = world.get_cell_at(int(start))
+        goal_cell = world.get_cell_at(int(goal))
+        path = world.find_path(start_cell, goal_cell)
+        assert len(path) == field[start]
+        previous = start
+        for cell in path:
+            i = cell.y * width + cell.x
+            assert i in world.neighbour_table[previous]
+            assert not cell.wall
+            previous = i
+        if start != goal:
+            dir, cell = world.get_step_towards(start_cell, goal_cell)
+            i = cell.y * width + cell.x
+            assert world.neighbour_table[start, dir] == i
+            assert field[i] == field[start] - 1
+
+    walled_in = world.get_cell(2, 2)
+    assert world.find_path(world.get_cell_at(cells[-1]), walled_in) is None
+    assert world.get_step_towards(world.get_cell_at(cells[-1]),
+                                  walled_in) is None
+
+
+def test_agent_goes_towards_a_cell_along_a_shortest_path():
+    world = make_world()
+    cells = free_cells(world)
+    agent = cellular.Agent()
+    world.add(agent, cell=world.get_cell_at(cells[0]))
+    goal = world.get_cell_at(cells[-1])
+    steps = breadth_first(world, cells[-1])[cells[0]]
+    for i in range(steps):
+        assert agent.go_towards(goal)
+    assert agent.cell is goal
@@ -0,0 +1,79 @@
+import numpy as np
+import pytest
+
+from pm import cellular
+from pm import continuous
+from pm import pacman_world
+from pm import raster
+
+room = """
+#######
+#     #
+# ### #
+#     #
+#######
+"""
+
+
+def make_world():
+    world = cellular.World(pacman_world.Cell, map=room, directions=4)
+    for x in range(1, 6):
+        world.get_cell(x, 1).food = True
+        world.get_cell(x, 3).food = True
+    body = continuous.Body()
+    body.color = 'yellow'
+    world.add(body, x=1, y=3, dir=1)
+    return world, body
+
+
+def test_render_draws_walls_food_and_agents():
+    world, body = make_world()
+    renderer = raster.RasterRenderer(world, scale=4)
+    image = renderer.render()
+    assert image.shape == (20, 28, 3)
+    assert tuple(image[1, 1]) == raster.rgb('blue')
+    # the middle of a food cell and the corner of an empty one
+    assert tuple(image[6, 10]) == raster.rgb('white')
+    assert tuple(image[4, 12]) == raster.rgb('black')
+    assert tuple(image[14, 6]) == raster.rgb('yellow')
+
+
+@pytest.mark.parametrize('delta', [False, True])
+def test_recorded_frames_read_back(tmpdir, delta):
+    world, body = make_world()
+    renderer = raster.RasterRenderer(world, scale=3)
+    path = str(tmpdir.join('frames.bin'))
+    expected = []
+    with raster.FrameRecorder(path, renderer, interval=0.1, delta=delta,
+                              keyframe=4, chunk=1024) as recorder:
+        for step in range(12):
+            recorder(step * 0.1)
+            expected.append(renderer.render())
+            body.go_forward(0.4)
+            world.get_cell(1 + step % 5, 3).food = False
+    header, count, start = raster.read_header(path)
+    assert count == 12 and header['delta'] == delta
+    frames = [frame.copy() for frame in raster.iter_frames(path)]
+    assert len(frames) == 12
+    for frame, image in zip(frames, expected):
+        assert np.array_equal(frame, image)
+
+
+def test_delta_round_trip():
+    rng = np.random.RandomState(0)
+    before = rng.randint(0, 256, (5, 7, 3)).astype(np.uint8)
+    after = before.copy()
+    after[1, 2:6] = 0
+    after[4, 6] = 1
+    payload = np.concatenate([part.view(np.uint8).reshape(-1)
+                              for part in raster.encode_delta(before, after)])
+    frame = before.copy()
+    raster.apply_delta(frame, payload)
+    assert np.array_equal(frame, after)
+
+
+def test_read_header_rejects_other_files(tmpdir):
+    path = tmpdir.join('other.bin')
+    path.write_binary(b'not frames at all')
+    with pytest.raises(cellular.CellularException):
+        raster.read_header(str(path))
@@ -0,0 +1,132 @@
+import math
+
+import numpy as np
+import pytest
+
+from pm import cellular
+from pm import continuous
+from pm import maze
+from pm import pacman_world
+
+
+def make_world(seed=2, **kwargs):
+    walls = np.asarray(maze.generateWalls(3, 3, seed=seed))
+    return cellular.World(pacman_world.Cell, walls=walls, directions=4,
+                          **kwargs)
+
+
+def march(world, x, y, dx, dy, max_distance, step=1e-3):
+    # the first wall along the ray, found by small steps
+    walls = world.fields['wall']
+    for k in range(int(max_distance / step) + 1):
+        t = k * step
+        cx = int(math.floor(x + t * dx + 0.5))
+        cy = int(math.floor(y + t * dy + 0.5))
+        if not (0 <= cx < world.width and 0 <= cy < world.height):
+            return max_distance, None
+        if walls[cy, cx]:
+            return t, (cx, cy)
+    return max_distance, None
+
+
+def where(cell):
+    return None if cell is None else (cell.x, cell.y)
+
+
+def random_rays(world, count, seed=0):
+    rng = np.random.RandomState(seed)
+    free = np.flatnonzero(~world.fields['wall'].reshape(-1))
+    for i in rng.choice(free, count):
+        y, x = divmod(int(i), world.width)
+        angle = rng.uniform(0, 2 * math.pi)
+        yield (x + rng.uniform(-0.45, 0.45), y + rng.uniform(-0.45, 0.45),
+               math.cos(angle), math.sin(angle))
+
+
+@pytest.mark.parametrize('max_distance', [7.5, None])
+def test_cast_ray_matches_marching(max_distance):
+    world = make_world()
+    limit = max_distance
+    if limit is None:
+        limit = world.width + world.height
+    for x, y, dx, dy in random_rays(world, 200):
+        t, cell = world.cast_ray(x, y, dx, dy, max_distance)
+        expected_t, expected_cell = march(world, x, y, dx, dy, limit)
+        if expected_cell is None:
+            assert cell is None and t == limit
+        else:
+            assert (cell.x, cell.y) == expected_cell
+            assert expected_t - 1e-3 <= t <= expected_t + 1e-9
+
+
+def test_detect_does_not_move_the_agent():
+    world = make_world()
+    body = continuous.Body()
+    world.add(body, x=5, y=5, dir=0)
+    body.x, body.y = 5.2, 4.9
+    for direction in np.linspace(0, 4, 16, endpoint=False):
+        distance, obstacle = body.detect(direction)
+        assert (body.x, body.y, body.dir) == (5.2, 4.9, 0)
+        assert body.cell is world.get_cell(5, 5)
+        if obstacle is not None:
+            assert obstacle.wall
+
+
+@pytest.mark.parametrize('agents', [3, 40])
+def test_radar_matches_detect(agents):
+    world = make_world()
+    rng = np.random.RandomState(1)
+    bodies = []
+    free = np.flatnonzero(~world.fields['wall'].reshape(-1))
+    for i in rng.choice(free, agents):
+        y, x = divmod(int(i), world.width)
+        body = continuous.Body()
+        world.add(body, x=x, y=y, dir=rng.randint(4))
+        # some bodies stay on the centre of their cell
+        if rng.rand() < 0.7:
+            body.x += rng.uniform(-0.45, 0.45)
+            body.y += rng.uniform(-0.45, 0.45)
+            body.dir += rng.uniform(0, 1)
+        bodies.append(body)
+    angles = np.array([-1, -0.5, 0, 0.5, 1])
+    xs = [b.x for b in bodies]
+    ys = [b.y for b in bodies]
+    dirs = [b.dir for b in bodies]
+    for max_distance in (6, None):
+        result = world.radar(xs, ys, dirs, angles, max_distance=max_distance)
+        assert result.shape == (agents, len(angles))
+        for body, row in zip(bodies, result):
+            expected = [body.detect((body.dir + a) % 4, max_distance)[0]
+                        for a in angles]
+            assert np.allclose(row, expected)
+
+
+def test_any_wall_matches_the_wall_field():
+    world = make_world(seed=3)
+    walls = world.fields['wall']
+    rng = np.random.RandomState(2)
+    for i in range(300):
+        x0, x1 = sorted(rng.randint(-3, world.width + 3, 2))
+        y0, y1 = sorted(rng.randint(-3, world.height + 3, 2))
+        if rng.rand() < 0.5:
+            # small regions that often hold no wall
+            x1, y1 = x0 + rng.randint(3), y0 + rng.randint(3)
+        expected = walls[max(y0, 0):max(y1 + 1, 0),
+                         max(x0, 0):max(x1 + 1, 0)].any()
+        assert world.any_wall(x0, y0, x1, y1) == expected
+
+
+def test_pyramid_rays_match_plain_rays():
+    world = make_world(seed=3)
+    plain = make_world(seed=3)
+    plain.pyramid_distance = None
+    # walls changed after the pyramid is built are counted too
+    world.get_wall_pyramid()
+    for w in (world, plain):
+        w.get_cell(12, 12).wall = True
+        w.get_cell(1, 1).wall = False
+    for x, y, dx, dy in random_rays(world, 200, seed=4):
+        t, cell = world.cast_ray(x, y, dx, dy, 100)
+        expected_t, expected_cell = plain.cast_ray(x, y, dx, dy, 100)
+        assert where(cell) == where(expected_cell)
+        assert abs(t - expected_t) < 1e-9
@@ -0,0 +1,97 @@
+import numpy as np
+import pytest
+
+import grid
+import td_grid
+from pm import cellular
+from pm import continuous
+from pm import pacman_world
+
+td_map = """
+#######
+#     #
+#  G  #
+#     #
+#######
+"""
+
+worlds = [(td_grid, td_grid.GridCell, td_grid.ContinuousAgent),
+          (grid, grid.GridCell, grid.ContinuousAgent),
+          (cellular, pacman_world.Cell, continuous.Body)]
+
+
+def copy_fields(world):
+    return dict((k, np.asarray(v).copy()) for k, v in world.fields.items())
+
+
+def pose(agent):
+    return agent.cell.x, agent.cell.y, agent.x, agent.y, agent.dir
+
+
+@pytest.mark.parametrize('module, cell, agent', worlds)
+def test_restore_undoes_changes(module, cell, agent):
+    world = module.World(cell, map=td_map, directions=4)
+    first = agent()
+    second = agent()
+    world.add(first, x=1, y=1, dir=1)
+    world.add(second, x=4, y=3, dir=0)
+    assert len(list(world.find_cells(lambda c: c.wall))) == world.count('wall')
+    walls = world.count('wall')
+    fields = copy_fields(world)
+    poses = [pose(first), pose(second)]
+    snapshot = world.snapshot()
+
+    world.get_cell(2, 2).wall = True
+    world.get_cell(5, 1).wall = False
+    first.go_forward(2)
+    first.turn(0.5)
+    world.remove(second)
+    world.add(agent(), x=3, y=3)
+    world.age += 10
+
+    world.restore(snapshot)
+    for k, v in copy_fields(world).items():
+        assert np.array_equal(v, fields[k])
+    assert world.agents == [first, second]
+    assert [pose(first), pose(second)] == poses
+    assert second.world is world
+    assert world.count('wall') == walls
+    assert not world.get_cell(2, 2).wall
+
+    # a snapshot can be restored more than once
+    first.go_forward(1)
+    world.restore(snapshot)
+    assert pose(first) == poses[0]
+
+
+def test_restore_rejects_another_kind_of_world():
+    world = cellular.World(pacman_world.Cell, map=td_map, directions=4)
+    other = td_grid.World(td_grid.GridCell, map=td_map, directions=4)
+    with pytest.raises(cellular.CellularException):
+        world.restore(other.snapshot())
+
+
+@pytest.mark.parametrize('packed', [False, True])
+def test_restore_keeps_indexes_up_to_date(packed):
+    world = cellular.World(pacman_world.Cell, map=td_map, directions=4,
+                           packed=packed, compact=packed)
+    for cell in world.find_cells(lambda c: not c.wall):
+        cell.food = (cell.x + cell.y) % 2 == 0
+    index = world.get_index('food')
+    buckets = world.get_buckets('food')
+    changes = world.track_changes()
+    snapshot = world.snapshot()
+    changes.take()
+    world.get_cell(1, 1).food = False
+    world.get_cell(2, 1).food = True
+    world.get_cell(3, 3).food = False
+    changes.take()
+
+    world.restore(snapshot)
+    # the index and buckets are updated in place rather than built again
+    assert world.get_index('food') is index
+    assert world.get_buckets('food') is buckets
+    expected = np.flatnonzero(np.asarray(world.fields['food']))
+    assert sorted(index.array().tolist()) == expected.tolist()
+    assert sorted(buckets.near(3, 2, 10).tolist()) == expected.tolist()
+    assert changes.take() == set([1 * 7 + 1, 1 * 7 + 2, 3 * 7 + 3])
@@ -0,0 +1,226 @@
+import gc
+import re
+import threading
+import time
+
+import nengo
+import numpy as np
+import pytest
+
+import grid
+from pm import cellular
+from pm import continuous
+from pm import display
+from pm import maze
+from pm import pacman_world
+
+grid_map = """
+#########
+#   R   #
+# ## ## #
+#G     R#
+#########
+"""
+
+
+def elements(svg):
+    # the drawn elements of an SVG, in no particular order, with the
+    # sprite ids of different GridNodes made the same
+    svg = re.sub(r'\bs\d+-', 's-', svg)
+    return sorted(re.findall(r'<[^<>]*/>', svg))
+
+
+def make_pacman_world():
+    walls = np.asarray(maze.generateWalls(2, 2, seed=0))
+    world = cellular.World(pacman_world.Cell, walls=walls, directions=4)
+    world.fields['food'][~walls] = True
+    for i in range(3):
+        body = continuous.Body()
+        body.typeBody = 'ghost'
+        body.size = 0.37
+        world.add(body)
+    return world, pacman_world.GridNode
+
+
+def make_grid_world():
+    world = grid.World(grid.GridCell, map=grid_map, directions=4)
+    for i in range(3):
+        world.add(grid.ContinuousAgent())
+    return world, grid.GridNode
+
+
+def change(world, rng):
+    # move the agents and change a few cells
+    for agent in world.agents:
+        agent.turn(rng.uniform(-1, 1))
+        agent.go_forward(rng.uniform(0, 1))
+    for i in range(3):
+        cell = world.get_cell(rng.randint(1, world.width - 1),
+                              rng.randint(1, world.height - 1))
+        if rng.rand() < 0.3:
+            cell.wall = not cell.wall
+        elif 'food' in world.fields:
+            cell.food = not cell.food
+        else:
+            cell.reward = rng.randint(-1, 2)
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('make_world', [make_pacman_world, make_grid_world])
+def test_incremental_svg_matches_a_full_redraw(make_world, compact):
+    world, node_class = make_world()
+    rng = np.random.RandomState(0)
+    with nengo.Network():
+        node = node_class(world, compact=compact)
+        for step in range(15):
+            svg = node.generate_svg(world)
+            fresh = node_class(world, compact=compact).generate_svg(world)
+            assert elements(svg) == elements(fresh)
+            change(world, rng)
+
+
+def test_merged_rectangles_cover_the_mask():
+    rng = np.random.RandomState(1)
+    for i in range(20):
+        mask = rng.rand(rng.randint(1, 12), rng.randint(1, 12)) < 0.6
+        covered = np.zeros(mask.shape, dtype=int)
+        for x, y, w, h in display.merge_rectangles(mask):
+            covered[y:y + h, x:x + w] += 1
+        assert np.array_equal(covered, mask)
+
+
+@pytest.mark.parametrize('make_world', [make_pacman_world, make_grid_world])
+def test_compact_svg_draws_the_same_walls_and_agents(make_world):
+    world, node_class = make_world()
+    with nengo.Network():
+        svg = node_class(world, compact=True).generate_svg(world)
+    walls = np.zeros((world.height, world.width), dtype=int)
+    for path in re.findall(r'<path d="([^"]*)"', svg):
+        for x, y, w, h in re.findall(r'M(\d+) (\d+)h(\d+)v(\d+)', path):
+            walls[int(y):int(y) + int(h), int(x):int(x) + int(w)] += 1
+    assert np.array_equal(walls, np.asarray(world.fields['wall']))
+    # one sprite for the agents, used once by each
+    assert len(re.findall(r'<defs>.*? id=', svg)) == 1
+    assert svg.count('<use ') == len(world.agents)
+
+
+@pytest.mark.parametrize('make_world', [make_pacman_world, make_grid_world])
+def test_svg_layers_stop_tracking_changes(make_world):
+    world, node_class = make_world()
+    watched = set(world._watched)
+    with nengo.Network():
+        node = node_class(world)
+        node.generate_svg(world)
+        assert len(world._changes) == 1 and world._watched > watched
+        # a node that moves on to another world lets go of this one
+        other, node_class = make_world()
+        node.generate_svg(other)
+        assert world._changes == [] and world._watched == watched
+        node.close()
+        assert other._changes == []
+
+    layers = display.SvgLayers(world, str, str, str)
+    layers.close()
+    layers.close()
+    assert world._changes == [] and world._watched == watched
+    # layers that are dropped let go of their world too
+    layers = display.SvgLayers(world, str, str, str)
+    del layers
+    gc.collect()
+    assert world._changes == []
+
+
+def test_svg_number():
+    assert display.svg_number(1.0) == '1'
+    assert display.svg_number(0.125) == '0.12'
+    assert display.svg_number(-0.001) == '0'
+
+
+def wait_for(worker):
+    for i in range(500):
+        if not worker.busy:
+            return
+        time.sleep(0.01)
+    raise AssertionError('the frame was never rendered')
+
+
+def test_frame_worker_paces_frames(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(time, 'time', lambda: now[0])
+    done = []
+    worker = display.FrameWorker(lambda frame: frame * 2, done.append,
+                                  max_fps=10)
+    assert worker.ready()
+    worker.submit(1)
+    assert done == [2]
+    now[0] += 0.05
+    assert not worker.ready()
+    now[0] += 0.05
+    assert worker.ready()
+
+
+def test_threaded_frame_worker():
+    done = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def render(frame):
+        started.set()
+        release.wait(5)
+        if frame is None:
+            raise ValueError('no frame')
+        return frame * 2
+
+    worker = display.FrameWorker(render, done.append, threaded=True)
+    worker.submit(3)
+    started.wait(5)
+    assert not worker.ready()
+    release.set()
+    wait_for(worker)
+    assert done == [6]
+    worker.submit(None)
+    wait_for(worker)
+    with pytest.raises(ValueError):
+        worker.ready()
+    assert worker.ready()
+
+
+def test_frame_worker_threads_end():
+    done = []
+    worker = display.FrameWorker(lambda frame: frame * 2, done.append,
+                                 threaded=True, idle=0.05)
+    worker.submit(1)
+    thread = worker.thread
+    worker.stop()
+    assert done == [2] and not thread.is_alive() and worker.thread is None
+    worker.stop()
+    # a stopped worker starts a new thread for the next frame
+    worker.submit(2)
+    wait_for(worker)
+    assert done == [2, 4]
+    # which ends by itself once no frames have come for a while
+    thread = worker.thread
+    thread.join(5)
+    assert not thread.is_alive() and worker.thread is None
+    worker.submit(3)
+    worker.stop()
+    assert done == [2, 4, 6]
+
+
+@pytest.mark.parametrize('make_world', [make_pacman_world, make_grid_world])
+def test_threaded_grid_node_shows_the_latest_frame(make_world):
+    world, node_class = make_world()
+    rng = np.random.RandomState(2)
+    with nengo.Network():
+        node = node_class(world, dt=0.001, threaded=True)
+        fresh = node_class(world)
+        for step in range(5):
+            node.output(step * 0.001)
+            wait_for(node.worker)
+            assert (elements(node.output._nengo_html_) ==
+                    elements(fresh.generate_svg(world)))
+            change(world, rng)
+        thread = node.worker.thread
+        node.close()
+        assert not thread.is_alive()
+        assert world._changes == [fresh.layers.changes]
@@ -0,0 +1,57 @@
+import pytest
+
+import grid
+import td_grid
+from pm import cellular
+from pm import continuous
+
+# a room with a wall down column 10
+room = '\n'.join(['#' * 20] +
+                 ['#' + ' ' * 9 + '#' + ' ' * 8 + '#'] * 10 +
+                 ['#' * 20])
+
+bodies = [(grid, grid.ContinuousAgent), (td_grid, td_grid.ContinuousAgent),
+          (cellular, continuous.Body)]
+
+
+def make_world(module):
+    class Cell(module.Cell):
+        __slots__ = ()
+
+        def load(self, char):
+            if char == '#':
+                self.wall = True
+
+    return module.World(Cell, map=room, directions=4)
+
+
+@pytest.mark.parametrize('module, body_class', bodies)
+def test_move_ending_on_a_wall_boundary_stops_outside(module, body_class):
+    world = make_world(module)
+    body = body_class()
+    world.add(body, x=8, y=5, dir=1)
+    assert not body.go_forward(1.5)
+    assert (body.cell.x, body.cell.y) == (9, 5)
+    assert body.x < 9.5
+    assert not body.cell.wall
+
+
+@pytest.mark.parametrize('module, body_class', bodies)
+def test_diagonal_slide_does_not_enter_the_wall(module, body_class):
+    world = make_world(module)
+    body = body_class()
+    world.add(body, x=8, y=5, dir=1.5)
+    body.go_forward(3, slide=True)
+    assert not body.cell.wall
+    assert body.cell.x == 9
+    assert body.x <= 9.5
+
+
+@pytest.mark.parametrize('module, body_class', bodies)
+def test_long_move_stops_at_the_first_wall(module, body_class):
+    world = make_world(module)
+    body = body_class()
+    world.add(body, x=2, y=5, dir=1)
+    assert not body.go_forward(12)
+    assert (body.cell.x, body.cell.y) == (9, 5)
+    assert 9.0 < body.x < 9.5
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+
+from pm import cellular
+from pm import maze
+from pm import pacman_world
+
+
+def make_walls(seed=0):
+    return np.asarray(maze.generateWalls(2, 3, seed=seed))
+
+
+def map_text(walls):
+    return '\n'.join(''.join('#' if w else ' ' for w in row) for row in walls)
+
+
+def make_tiled(walls, tmpdir, **kwargs):
+    return cellular.TiledWorld(pacman_world.Cell, directions=4, tile_size=4,
+                               max_tiles=3, tile_dir=str(tmpdir), **kwargs)
+
+
+@pytest.mark.parametrize('source', ['map', 'generator'])
+def test_tiled_world_matches_world(tmpdir, source):
+    walls = make_walls()
+    world = cellular.World(pacman_world.Cell, walls=walls, directions=4)
+    if source == 'map':
+        tiled = make_tiled(walls, tmpdir, map=map_text(walls))
+    else:
+        tiled = make_tiled(walls, tmpdir, width=walls.shape[1],
+                           height=walls.shape[0],
+                           generator=lambda xs, ys: {'wall': walls[ys, xs]})
+    assert (tiled.width, tiled.height) == (world.width, world.height)
+    for y in range(world.height):
+        for x in range(world.width):
+            assert tiled.get_cell(x, y).wall == world.get_cell(x, y).wall
+    assert len(tiled._tiles) <= 3
+    assert ([(c.x, c.y) for c in tiled.find_cells('wall')] ==
+            [(c.x, c.y) for c in world.find_cells('wall')])
+
+    rng = np.random.RandomState(0)
+    xs = rng.uniform(1, world.width - 2, 20)
+    ys = rng.uniform(1, world.height - 2, 20)
+    dirs = rng.uniform(0, 4, 20)
+    angles = np.linspace(-1, 1, 5)
+    assert np.allclose(tiled.radar(xs, ys, dirs, angles),
+                       world.radar(xs, ys, dirs, angles))
+
+
+def test_changed_tiles_survive_being_dropped(tmpdir):
+    walls = make_walls()
+    tiled = make_tiled(walls, tmpdir, map=map_text(walls))
+    food = tiled.count('food')
+    tiled.get_cell(1, 1).food = True
+    tiled.get_cell(13, 17).food = True
+    # touch every tile, so the changed ones are written out
+    for y in range(0, tiled.height, 4):
+        for x in range(0, tiled.width, 4):
+            tiled.get_cell(x, y).wall
+    assert tmpdir.listdir()
+    assert tiled.get_cell(1, 1).food and tiled.get_cell(13, 17).food
+    assert tiled.count('food') == food + 2
+
+
+def test_whole_map_tables_are_refused(tmpdir):
+    tiled = make_tiled(None, tmpdir, width=8, height=8)
+    for method in (tiled.get_wall_distances, tiled.snapshot):
+        with pytest.raises(cellular.CellularException):
+            method()
@@ -0,0 +1,61 @@
+import numpy as np
+import pytest
+
+import td_grid
+
+room = """
+#######
+#     #
+#  G  #
+# #   #
+#######
+"""
+
+
+def make_world():
+    return td_grid.World(td_grid.GridCell, map=room, directions=4)
+
+
+def test_steps_match_moving_one_agent_at_a_time():
+    world = make_world()
+    envs = td_grid.VecWorld(world, 6, seed=0)
+    rng = np.random.RandomState(0)
+    positions = envs.observe()
+    starts = set((i % world.width, i // world.width) for i in envs.starts)
+    assert set(map(tuple, positions.tolist())) <= starts
+    for step in range(100):
+        actions = rng.randint(4, size=6)
+        observed, rewards, terminal = envs.step(actions)
+        for i, action in enumerate(actions):
+            x, y = positions[i]
+            dx, dy = td_grid.VecWorld.action_offsets[action]
+            cell = world.get_cell(x + dx, y + dy)
+            if cell.wall:
+                assert rewards[i] == -1 and not terminal[i]
+                assert tuple(observed[i]) == (x, y)
+            elif cell.reward > 0:
+                assert rewards[i] == cell.reward and terminal[i]
+                assert tuple(observed[i]) in starts
+            else:
+                assert rewards[i] == cell.reward and not terminal[i]
+                assert tuple(observed[i]) == (x + dx, y + dy)
+        positions = observed
+
+
+def test_copies_have_their_own_random_streams():
+    world = make_world()
+    few = td_grid.VecWorld(world, 2, seed=5)
+    many = td_grid.VecWorld(world, 8, seed=5)
+    rng = np.random.RandomState(1)
+    for step in range(50):
+        actions = rng.randint(4, size=8)
+        a = few.step(actions[:2])
+        b = many.step(actions)
+        for x, y in zip(a, b):
+            assert np.array_equal(x, y[:2])
+
+
+def test_needs_start_positions():
+    world = make_world()
+    with pytest.raises(td_grid.CellularException):
+        td_grid.VecWorld(world, 2, starts=[])
@@ -0,0 +1,276 @@
+import numpy as np
+import pytest
+
+import grid
+import td_grid
+from pm import cellular
+from pm import continuous
+from pm import pacman_world
+
+td_map = """
+#######
+#     #
+#  G  #
+#     #
+#######
+"""
+
+modules = [grid, td_grid, cellular]
+
+
+def make_cell(module):
+    class Cell(module.Cell):
+        __slots__ = ()
+        reward = 0
+
+        def load(self, char):
+            if char == '#':
+                self.wall = True
+            elif char == 'G':
+                self.reward = 1
+
+    return Cell
+
+
+@pytest.mark.parametrize('compact', [False, True])
+@pytest.mark.parametrize('module', modules)
+def test_cells_are_views_of_the_field_arrays(module, compact):
+    world = module.World(make_cell(module), map=td_map, directions=4,
+                         compact=compact)
+    assert set(world.fields) >= set(['wall', 'reward'])
+    assert world.fields['wall'].shape == (5, 7)
+    assert world.fields['wall'].sum() == 7 * 2 + 3 * 2
+    assert world.fields['reward'][2, 3] == 1
+    cell = world.get_cell(1, 1)
+    cell.reward = 0.5
+    assert world.fields['reward'][1, 1] == 0.5
+    world.fields['wall'][1, 2] = True
+    world.invalidate('wall')
+    assert world.get_cell(2, 1).wall
+    assert world.get_cell_at(1 * 7 + 2).wall
+    assert world.get_cell(3, 2).reward == 1
+
+
+def test_compact_world_matches_normal_world():
+    walls = np.random.RandomState(0).rand(9, 11) < 0.3
+    normal = cellular.World(pacman_world.Cell, walls=walls, directions=8)
+    compact = cellular.World(pacman_world.Cell, walls=walls, directions=8,
+                             compact=True)
+    for y in range(9):
+        for x in range(11):
+            a, b = normal.get_cell(x, y), compact.get_cell(x, y)
+            assert (a.wall, a.food) == (b.wall, b.food)
+    compact.get_cell(4, 4).food = True
+    assert compact.get_cell(4, 4).food
+
+
+@pytest.mark.parametrize('directions', [4, 6, 8])
+@pytest.mark.parametrize('module', modules)
+def test_neighbour_table_matches_direction_offsets(module, directions):
+    world = module.World(make_cell(module), width=7, height=6,
+                         directions=directions)
+    table = world.neighbour_table
+    assert table.shape == (42, directions)
+    for y in range(6):
+        for x in range(7):
+            cell = world.get_cell(x, y)
+            for dir in range(directions):
+                nx, ny = world.get_point_in_direction(x, y, dir)
+                assert table[y * 7 + x, dir] == ny * 7 + nx
+                assert cell.neighbours[dir] is world.get_cell(nx, ny)
+
+
+@pytest.mark.parametrize('directions', [4, 6, 8])
+def test_packed_neighbour_table_matches_stored_table(directions):
+    walls = np.zeros((6, 7), dtype=bool)
+    normal = cellular.World(pacman_world.Cell, walls=walls,
+                            directions=directions)
+    packed = cellular.World(pacman_world.Cell, walls=walls, packed=True,
+                            directions=directions)
+    indices = np.arange(42)
+    assert np.array_equal(packed.neighbour_table[indices],
+                          normal.neighbour_table)
+    for i in range(42):
+        for dir in range(directions):
+            assert (packed.neighbour_table.item(i, dir) ==
+                    normal.neighbour_table[i, dir])
+
+
+class Spreading(cellular.Cell):
+    __slots__ = ()
+    on = False
+
+    def update(self):
+        self.on = self.on or any(n.on for n in self.neighbours)
+
+
+class SpreadingKernel(Spreading):
+    __slots__ = ()
+
+    @staticmethod
+    def kernel(world, state, out):
+        out['on'][:] = state['on'] | state['on'][
+            world.neighbour_table].any(axis=1)
+
+
+@pytest.mark.parametrize('cell', [Spreading, SpreadingKernel])
+def test_update_reads_the_previous_step(cell):
+    world = cellular.World(cell, width=9, height=7, directions=4)
+    world.get_cell(4, 3).on = True
+    assert world.count('on') == 1
+    for step in range(1, 4):
+        world.update()
+        ys, xs = np.mgrid[:7, :9]
+        # double buffering spreads one cell a step
+        expected = np.abs(xs - 4) + np.abs(ys - 3) <= step
+        assert np.array_equal(world.fields['on'], expected)
+        assert world.count('on') == expected.sum()
+    assert world.age == 3
+
+
+def test_field_indexes_follow_changes():
+    rng = np.random.RandomState(3)
+    walls = rng.rand(10, 12) < 0.3
+    world = cellular.World(pacman_world.Cell, walls=walls, directions=4)
+
+    def check():
+        for name, test in (('food', lambda c: c.food),
+                           ('wall', lambda c: c.wall),
+                           ('free', lambda c: not c.wall)):
+            expected = [(c.x, c.y) for c in world.find_cells(test)]
+            found = [(c.x, c.y) for c in world.find_cells(name)]
+            assert found == expected
+            assert world.count(name) == len(expected)
+            xs, ys = world.where(name)
+            assert list(zip(xs.tolist(), ys.tolist())) == expected
+
+    check()
+    for i in range(200):
+        cell = world.get_cell(rng.randint(12), rng.randint(10))
+        if rng.rand() < 0.5:
+            cell.food = not cell.food
+        else:
+            cell.wall = not cell.wall
+    check()
+    world.fields['food'][:] = rng.rand(10, 12) < 0.5
+    world.invalidate('food')
+    check()
+
+
+def test_occupancy_follows_moving_agents():
+    rng = np.random.RandomState(4)
+    world = cellular.World(pacman_world.Cell, width=30, height=25,
+                           directions=4)
+    bodies = []
+    for i in range(40):
+        body = continuous.Body()
+        world.add(body, x=rng.randint(30), y=rng.randint(25),
+                  dir=rng.randint(4))
+        bodies.append(body)
+    for step in range(20):
+        for body in bodies:
+            body.turn(rng.uniform(-1, 1))
+            body.go_forward(rng.uniform(0, 0.8))
+        world.remove(bodies.pop())
+
+        for body in bodies:
+            assert body in body.cell.agents
+        assert sum(len(world.occupancy.at(i))
+                   for i in range(30 * 25)) == len(bodies)
+        x, y = rng.uniform(0, 30), rng.uniform(0, 25)
+        radius = rng.uniform(1, 12)
+        near = set(world.occupancy.near(x, y, radius))
+        assert near == set(b for b in bodies
+                           if (b.x - x) ** 2 + (b.y - y) ** 2 <= radius ** 2)
+        nearest = world.occupancy.nearest(x, y, k=3)
+        distances = sorted((b.x - x) ** 2 + (b.y - y) ** 2 for b in bodies)
+        assert [(b.x - x) ** 2 + (b.y - y) ** 2
+                for b in nearest] == distances[:3]
+
+
+@pytest.mark.parametrize('directions', [4, 8])
+def test_wall_distances_match_stepping(directions):
+    rng = np.random.RandomState(5)
+    walls = rng.rand(9, 12) < 0.2
+    world = cellular.World(pacman_world.Cell, walls=walls,
+                           directions=directions)
+    limit = world.width + world.height
+
+    def check():
+        distances = world.get_wall_distances()
+        for y in range(world.height):
+            for x in range(world.width):
+                for dir in range(directions):
+                    dx, dy = world.offsets[0][dir]
+                    steps = 1
+                    while True:
+                        nx, ny = x + steps * dx, y + steps * dy
+                        if not (0 <= nx < world.width and
+                                0 <= ny < world.height):
+                            steps = limit
+                            break
+                        if world.fields['wall'][ny, nx]:
+                            break
+                        steps += 1
+                    assert distances[y * world.width + x, dir] == steps
+
+    check()
+    world.get_cell(5, 4).wall = not world.get_cell(5, 4).wall
+    check()
+
+
+@pytest.mark.parametrize('module', modules)
+def test_slotted_cells_and_agents(module):
+    world = module.World(make_cell(module), map=td_map, directions=4)
+    cell = world.get_cell(2, 2)
+    assert not hasattr(cell, '__dict__')
+    with pytest.raises(AttributeError):
+        cell.colour = 'red'
+    assert (cell.neighbours is cell.neighbors is cell.neighbour is
+            cell.neighbor)
+    assert cell.neighbours[1] is world.get_cell(3, 2)
+
+    agent = module.Agent()
+    assert agent.cell is None
+    world.add(agent, cell=cell, dir=1)
+    agent.colour = 'red'
+    assert agent.ahead_cell is agent.get_cell_ahead() is world.get_cell(3, 2)
+    assert agent.left_cell is world.get_cell(2, 1)
+    assert agent.right_cell is world.get_cell(2, 3)
+    assert cell.agents == (agent,)
+    with pytest.raises(AttributeError):
+        cell.agents.append(module.Agent())
+
+
+class Lit(cellular.Cell):
+    # no __slots__, so `lit` lives in each Cell's __dict__
+    def __init__(self):
+        self.lit = False
+
+    def update(self):
+        self.lit = self.lit or any(n.lit for n in self.neighbours)
+
+
+def test_cells_with_a_dict_are_double_buffered():
+    world = cellular.World(Lit, width=9, height=7, directions=4)
+    assert 'lit' not in world.fields
+    world.get_cell(4, 3).lit = True
+    world.update()
+    world.update()
+    ys, xs = np.mgrid[:7, :9]
+    expected = np.abs(xs - 4) + np.abs(ys - 3) <= 2
+    assert np.array_equal([[c.lit for c in row] for row in world.grid],
+                          expected)
+
+
+@pytest.mark.parametrize('module', [grid, td_grid])
+def test_grid_modules_share_the_engine(module):
+    world = module.World(width=3, height=2)
+    assert isinstance(world, cellular.World)
+    assert world.Cell is module.Cell
+    assert world.fields['reward'].shape == (2, 3)
+    assert 'reward' not in cellular.World(width=3, height=2).fields
+    agent = module.ContinuousAgent()
+    world.add(agent, x=1, y=1)
+    assert isinstance(agent, continuous.Body)
+    assert isinstance(agent, module.Agent)